@@ -0,0 +1,227 @@
+"""
+stacks some columns of the agency csv files into a single csv file, optionally
+dropping duplicate rows. Each file's columns are cached by content hash, so only new
+or changed files are read again
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import numpy as np
+from dedupe import SeenKeys
+from manifest import (
+    fragment_path,
+    hash_files,
+    is_cached,
+    options_key,
+    prune_cache,
+    read_manifest,
+    write_manifest,
+)
+
+logging.basicConfig(filename="output/extract.log", filemode="w", level=logging.INFO)
+
+# number of rows hashed and checked against the rows already written at a time, when
+# dropping duplicates
+UNIQUE_BATCH_ROWS = 100_000
+
+
+def cut_file(filename, columns, fragment):
+    """
+    writes some columns of a csv file to a fragment without a header, like
+    `csvcut -c` does. The fragment is written under a temporary name first, so an
+    interrupted run can't leave a partial fragment behind
+
+    Args:
+        filename (str): path to csv file
+        columns (list): names of columns to keep, in output order
+        fragment (str): path to write csv to
+
+    Raises:
+        ValueError: if any column isn't in the csv file
+
+    Returns:
+        int: number of rows written
+    """
+    temp_fragment = f"{fragment}.tmp"
+    n_rows = 0
+    with open(filename, "r", encoding="utf-8-sig", newline="") as in_file, open(
+        temp_fragment, "w", encoding="utf-8", newline=""
+    ) as out_file:
+        reader = csv.reader(in_file)
+        header = next(reader)
+        missing = [column for column in columns if column not in header]
+        if len(missing) > 0:
+            raise ValueError(f"columns {missing} not found in '{filename}'")
+
+        indices = [header.index(column) for column in columns]
+        writer = csv.writer(out_file, lineterminator="\n")
+        for row in reader:
+            writer.writerow([row[i] for i in indices])
+            n_rows += 1
+
+    os.replace(temp_fragment, fragment)
+    return n_rows
+
+
+def row_digests(rows):
+    """
+    hashes csv rows to a 128-bit digest each, split into two 64-bit integers: a key
+    to look up in SeenKeys, and a check that tells rows apart if their keys collide
+
+    Args:
+        rows (list): csv rows
+
+    Returns:
+        tuple: numpy arrays of the keys and checks of rows
+    """
+    digests = b"".join(
+        hashlib.blake2b("\0".join(row).encode("utf-8"), digest_size=16).digest()
+        for row in rows
+    )
+    halves = np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+    return halves[:, 0], halves[:, 1]
+
+
+def new_rows(rows, seen):
+    """
+    finds the rows of a batch that weren't seen in earlier batches or earlier in the
+    batch, and adds them to seen
+
+    Args:
+        rows (list): csv rows
+        seen (SeenKeys): keys and checks of the rows written so far
+
+    Raises:
+        ValueError: if two different rows have the same key, which would drop one of
+            them
+
+    Returns:
+        numpy.ndarray: positions of the new rows in rows, in order
+    """
+    keys, checks = row_digests(rows)
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    written, changed = seen.lookup(keys[first], checks[first])
+    if changed.any() or (checks != checks[first][inverse]).any():
+        raise ValueError("two different rows have the same 64-bit hash")
+
+    new = np.sort(first[~written])
+    seen.add(keys[new], checks[new])
+    return new
+
+
+def write_fragments(fragments, columns, output_file, unique=False):
+    """writes fragments to a file under a single header, in the order of fragments
+
+    Args:
+        fragments (list): paths to fragments written by cut_file
+        columns (list): names of columns in fragments
+        output_file (file): open file to write to
+        unique (bool, optional): drop rows that were already written, keeping the
+            first one. Defaults to False.
+
+    Returns:
+        int: number of duplicate rows dropped
+    """
+    writer = csv.writer(output_file, lineterminator="\n")
+    writer.writerow(columns)
+
+    if not unique:
+        for fragment in fragments:
+            with open(fragment, "r", encoding="utf-8", newline="") as fragment_file:
+                shutil.copyfileobj(fragment_file, output_file)
+        return 0
+
+    # rows are kept as 16 bytes of hashes in numpy arrays however long they are
+    seen = SeenKeys()
+    n_dropped = 0
+    for fragment in fragments:
+        with open(fragment, "r", encoding="utf-8", newline="") as fragment_file:
+            reader = csv.reader(fragment_file)
+            for rows in iter(
+                lambda: list(itertools.islice(reader, UNIQUE_BATCH_ROWS)), []
+            ):
+                new = new_rows(rows, seen)
+                writer.writerows(rows[i] for i in new)
+                n_dropped += len(rows) - len(new)
+
+    return n_dropped
+
+
+def stack_files(filenames, columns, output, cache_dir, unique=False):
+    """
+    cuts the columns of files that aren't cached yet, then writes the fragments of
+    every file to output, in the order of filenames, under a single header
+
+    Args:
+        filenames (list): paths to csv files
+        columns (list): names of columns to keep
+        output (str): path to output csv
+        cache_dir (str): path to cache directory
+        unique (bool, optional): drop duplicate rows, keeping the first one.
+            Defaults to False.
+
+    Returns:
+        tuple: number of rows written and number of duplicate rows dropped
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = hash_files(filenames, read_manifest(cache_dir))
+    key = options_key(columns)
+    fragments = [
+        fragment_path(cache_dir, manifest[filename], key, "csv")
+        for filename in filenames
+    ]
+
+    for filename, fragment in zip(filenames, fragments):
+        if is_cached(manifest[filename], fragment):
+            logging.info("reusing cached fragment of unchanged file %s", filename)
+        else:
+            manifest[filename]["n_rows"] = cut_file(filename, columns, fragment)
+            logging.info("cut %s rows from %s", manifest[filename]["n_rows"], filename)
+
+    write_manifest(cache_dir, manifest)
+    prune_cache(cache_dir, manifest)
+
+    with open(output, "w", encoding="utf-8", newline="") as output_file:
+        n_dropped = write_fragments(fragments, columns, output_file, unique)
+
+    n_rows = sum(manifest[filename]["n_rows"] for filename in filenames)
+    return n_rows - n_dropped, n_dropped
+
+
+def parse_args():
+    """parses command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="+", help="csv files to stack")
+    parser.add_argument(
+        "--columns", required=True, help="comma-separated names of columns to keep"
+    )
+    parser.add_argument("--output", required=True, help="path to output csv")
+    parser.add_argument(
+        "--cache", required=True, help="directory to cache each file's columns in"
+    )
+    parser.add_argument(
+        "--unique",
+        action="store_true",
+        help="drop duplicate rows, keeping the first one",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    total_rows, n_dropped = stack_files(
+        args.files, args.columns.split(","), args.output, args.cache, args.unique
+    )
+    logging.info(
+        "Wrote %s rows from %s files to %s, dropped %s duplicate rows",
+        total_rows,
+        len(args.files),
+        args.output,
+        n_dropped,
+    )
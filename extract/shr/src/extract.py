@@ -0,0 +1 @@
+../../../shared/src/extract.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../shared/src/fwf.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../shared/src/manifest.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../../shared/src/columnar.py
\ No newline at end of file
@@ -1,13 +1,95 @@
 """handles custom commands for loading csv data to django"""
 
+from contextlib import contextmanager
 import csv
+import hashlib
+from functools import lru_cache, partial
+import io
 from itertools import islice
+import math
+import multiprocessing
+import os
+from queue import Empty
+from django.apps import apps
 from django.core.management.base import BaseCommand
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import CharField, IntegerField
 from django.db.models.fields.related import ForeignKey
+import pandas as pd
+import pyarrow.dataset as ds
 from tqdm import tqdm
 from data import models
-from .utils import guess_n_loops
+from .chunking import (
+    SAMPLE_ROWS,
+    bytes_per_row,
+    memory_budget,
+    pick_chunksize,
+    track_progress,
+)
+from .columnar import count_rows, is_parquet, iter_tables
+
+
+@lru_cache(maxsize=None)
+def foreign_key_field(model):
+    """gets the foreign key field of a model
+
+    Args:
+        model (django.db.models.Model): model class with one foreign key
+
+    Returns:
+        django.db.models.ForeignKey: foreign key field
+
+    Raises:
+        ValueError: if model has no foreign key
+        NotImplementedError: if model has multiple foreign keys
+    """
+    fk_fields = [
+        field for field in model._meta.get_fields() if isinstance(field, ForeignKey)
+    ]
+    if len(fk_fields) == 0:
+        raise ValueError(f"model '{model}' has no foreign key but one was passed")
+    elif len(fk_fields) > 1:
+        raise NotImplementedError(
+            f"model '{model}' has multiple foreign keys, which is not supported"
+        )
+
+    return fk_fields[0]
+
+
+@lru_cache(maxsize=None)
+def loaded_keys(model):
+    """
+    gets the primary keys of every row of a model in the database. They're read the
+    first time rows referencing the model are loaded, so the model's own rows must be
+    loaded first, and kept until loaded_keys.cache_clear(), which the load functions
+    call before loading and after each file, since the keys may have changed
+
+    Args:
+        model (django.db.models.Model): model class
+
+    Returns:
+        frozenset: primary keys
+    """
+    return frozenset(model.objects.values_list("pk", flat=True))
+
+
+def check_references(keys, fk_model):
+    """checks that every key refers to a row that's already loaded
+
+    Args:
+        keys (list): foreign keys of the rows being loaded
+        fk_model (django.db.models.Model): model class the keys refer to
+
+    Raises:
+        fk_model.DoesNotExist: if any key isn't the primary key of a loaded row
+    """
+    missing = set(keys) - loaded_keys(fk_model)
+    if missing:
+        raise fk_model.DoesNotExist(
+            f"{len(missing)} keys don't match any loaded {fk_model.__name__}, "
+            f"e.g. '{next(iter(missing))}'"
+        )
 
 
 def bulk_create(lines, model, preprocessors=None, fk_pk_field=None, fk_model=None):
@@ -33,6 +115,12 @@ def bulk_create(lines, model, preprocessors=None, fk_pk_field=None, fk_model=Non
     if any(foreign_args) and not all(foreign_args):
         raise ValueError("you must provide both fk_pk_field and fk_model")
 
+    if fk_pk_field is not None:
+        # the key is assigned to the foreign key's column, e.g. incident_id, so the
+        # rows it refers to aren't fetched. They're checked for all lines at once
+        fk_attname = foreign_key_field(model).attname
+        check_references([row_dict[fk_pk_field] for row_dict in lines], fk_model)
+
     dict_data = []
     for row_dict in lines:
         for field in preprocessors:
@@ -40,27 +128,7 @@ def bulk_create(lines, model, preprocessors=None, fk_pk_field=None, fk_model=Non
                 row_dict[field] = preprocessors[field](row_dict[field])
 
         if fk_pk_field is not None:
-            # get the name of the foreign key for model
-            fields = model._meta.get_fields()
-            fk_fields = []
-            for field in fields:
-                if isinstance(field, ForeignKey):
-                    fk_fields.append(field)
-
-            if len(fk_fields) == 0:
-                raise ValueError(
-                    f"model '{model}' has no foreign key but one was passed"
-                )
-            elif len(fk_fields) > 1:
-                raise NotImplementedError(
-                    f"model '{model}' has multiple foreign keys, which is not supported"
-                )
-            else:
-                fk_field = fk_fields[0]
-
-            foreign_obj = fk_model.objects.get(pk=row_dict[fk_pk_field])
-            row_dict[fk_field.name] = foreign_obj
-            del row_dict[fk_pk_field]
+            row_dict[fk_attname] = row_dict.pop(fk_pk_field)
 
         dict_data.append(row_dict)
 
@@ -68,6 +136,134 @@ def bulk_create(lines, model, preprocessors=None, fk_pk_field=None, fk_model=Non
     model.objects.bulk_create(objs)
 
 
+def db_value(field):
+    """
+    gets a function that converts a value from an input file to what the database
+    stores for a field, the same way bulk_create does
+
+    Args:
+        field (django.db.models.Field): model field
+
+    Returns:
+        function: converts one value
+    """
+    if isinstance(field, ForeignKey):
+        return db_value(field.target_field)
+    if isinstance(field, CharField):
+        return lambda val: val if val is None or isinstance(val, str) else str(val)
+    if isinstance(field, IntegerField):
+        return lambda val: val if val is None else int(val)
+
+    return partial(field.get_db_prep_save, connection=connection)
+
+
+@lru_cache(maxsize=None)
+def insert_plan(model, fk_pk_field=None):
+    """gets the query and columns for inserting rows of a model without the ORM
+
+    Args:
+        model (django.db.models.Model): type of model to insert
+        fk_pk_field (str, optional): name of field in input files containing the
+            foreign key. Defaults to None.
+
+    Returns:
+        tuple: INSERT query, and a tuple of each column's field in the input files,
+            default value and function from db_value
+    """
+    fields = model._meta.concrete_fields
+    columns = tuple(
+        (
+            fk_pk_field if isinstance(field, ForeignKey) else field.name,
+            field.get_default(),
+            db_value(field),
+        )
+        for field in fields
+    )
+    query = "INSERT INTO {} ({}) VALUES ({})".format(
+        connection.ops.quote_name(model._meta.db_table),
+        ", ".join(connection.ops.quote_name(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)),
+    )
+    return query, columns
+
+
+def prepare_rows(lines, model, preprocessors=None, fk_pk_field=None, fk_model=None):
+    """
+    converts lines of a csv.DictReader to tuples of the values in each column of a
+    model's table. Takes the same arguments as bulk_create
+
+    Returns:
+        tuple: arguments of insert_rows
+    """
+    if preprocessors is None:
+        preprocessors = {}
+
+    foreign_args = [arg is not None for arg in [fk_pk_field, fk_model]]
+    if any(foreign_args) and not all(foreign_args):
+        raise ValueError("you must provide both fk_pk_field and fk_model")
+
+    keys = []
+    if fk_pk_field is not None:
+        # raises if model doesn't have exactly one foreign key
+        foreign_key_field(model)
+        keys = [row_dict[fk_pk_field] for row_dict in lines]
+
+    query, columns = insert_plan(model, fk_pk_field)
+    converters = [
+        (name, default, preprocessors.get(name), convert)
+        for name, default, convert in columns
+    ]
+    rows = [
+        tuple(
+            convert(
+                row_dict.get(name, default)
+                if preprocess is None
+                else preprocess(row_dict.get(name, default))
+            )
+            for name, default, preprocess, convert in converters
+        )
+        for row_dict in lines
+    ]
+    return query, rows, fk_model, keys
+
+
+def insert_rows(query, rows, fk_model=None, keys=()):
+    """inserts rows from prepare_rows with executemany
+
+    Args:
+        query (str): INSERT query from insert_plan
+        rows (list): tuples of values to insert
+        fk_model (django.db.models.Model, optional): model class the rows refer to.
+            Defaults to None.
+        keys (list, optional): foreign keys of the rows. Defaults to ().
+    """
+    if fk_model is not None:
+        check_references(keys, fk_model)
+
+    with connection.cursor() as cursor:
+        cursor.executemany(query, rows)
+
+
+@contextmanager
+def load_pragmas():
+    """
+    sets the sqlite PRAGMAs in settings.LOAD_PRAGMAS while loading, and restores
+    their previous values afterwards
+    """
+    with connection.cursor() as cursor:
+        previous = {}
+        for pragma, value in settings.LOAD_PRAGMAS.items():
+            previous[pragma] = cursor.execute(f"PRAGMA {pragma}").fetchone()[0]
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for pragma, value in previous.items():
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
 def int_if_not_empty(val):
     if str(val) == "":
         return None
@@ -75,19 +271,19 @@ def int_if_not_empty(val):
     return int(float(val))
 
 
-def load_shr_incidents(lines):
+def load_shr_incidents(lines, create=bulk_create):
     preprocessors = {
         "year": int_if_not_empty,
         "last_update": lambda val: None if val == "" else val,
     }
-    bulk_create(lines, models.SHRIncidents, preprocessors)
+    return create(lines, models.SHRIncidents, preprocessors)
 
 
-def load_shr_offenders(lines):
+def load_shr_offenders(lines, create=bulk_create):
     preprocessors = {
         "offender_age": int_if_not_empty,
     }
-    bulk_create(
+    return create(
         lines,
         models.SHROffenders,
         preprocessors=preprocessors,
@@ -96,12 +292,12 @@ def load_shr_offenders(lines):
     )
 
 
-def load_shr_victims(lines):
+def load_shr_victims(lines, create=bulk_create):
     preprocessors = {
         "victim_age": int_if_not_empty,
         "year": int_if_not_empty,
     }
-    bulk_create(
+    return create(
         lines,
         models.SHRVictims,
         preprocessors=preprocessors,
@@ -115,26 +311,551 @@ LOADERS = {
     "input/shr_incidents.csv": load_shr_incidents,
     "input/shr_offenders.csv": load_shr_offenders,
     "input/shr_victims.csv": load_shr_victims,
-    "input/agencies.csv": lambda lines: bulk_create(lines, models.Agencies),
-    "input/reta_master.csv": lambda lines: bulk_create(lines, models.RetA),
+    "input/agencies.csv": lambda lines, create=bulk_create: create(
+        lines, models.Agencies
+    ),
+    "input/reta_master.csv": lambda lines, create=bulk_create: create(
+        lines, models.RetA
+    ),
 }
 
+# files in LOADERS that must be loaded before each file, because it refers to them
+DEPENDENCIES = {
+    "input/shr_offenders.csv": ["input/shr_incidents.csv"],
+    "input/shr_victims.csv": ["input/shr_incidents.csv"],
+}
+
+# model loaded from each file in LOADERS, and the year column its rows are grouped
+# by when loading incrementally
+PARTITIONS = {
+    "input/shr_incidents.csv": (models.SHRIncidents, "year"),
+    "input/shr_offenders.csv": (models.SHROffenders, "year"),
+    "input/shr_victims.csv": (models.SHRVictims, "year"),
+    "input/agencies.csv": (models.Agencies, "data_year"),
+    "input/reta_master.csv": (models.RetA, "year"),
+}
+
+# seconds the writer waits for a batch before checking that the workers are alive
+WORKER_POLL_SECONDS = 5
+
+# files that previous tasks only write as csv
+CSV_ONLY = ["input/agencies.csv"]
+
+
+def input_filename(filename, input_format):
+    """gets the path of an input file in the given format, csv or parquet"""
+    if input_format == "parquet" and filename not in CSV_ONLY:
+        return filename[: -len(".csv")] + ".parquet"
+
+    return filename
+
+
+def pick_batch_size(filename):
+    """picks the number of rows per bulk insert from a sample of a file
+
+    Args:
+        filename (str): path to csv file or parquet dataset
+
+    Returns:
+        int: number of rows that fit in settings.CHUNK_MEMORY_MB
+    """
+    if is_parquet(filename):
+        sample = next(iter_tables(filename, SAMPLE_ROWS))
+    else:
+        sample = pd.read_csv(
+            filename,
+            nrows=SAMPLE_ROWS,
+            dtype=str,
+            keep_default_na=False,
+            encoding="UTF-8",
+        )
+
+    return pick_chunksize(
+        bytes_per_row(sample), memory_budget(settings.CHUNK_MEMORY_MB)
+    )
+
+
+def read_chunks(filename, chunksize):
+    """reads a csv file or parquet dataset in chunks of rows, with a progress bar
+
+    Args:
+        filename (str): path to csv file or parquet dataset
+        chunksize (int): number of rows per chunk
+
+    Yields:
+        tuple: dicts of column names and values. Missing values in parquet datasets
+            are empty strings, as they are in csv.DictReader
+    """
+    desc = f"load {filename}"
+    if not is_parquet(filename):
+        # progress is tracked by the offset in the binary file under the reader, since
+        # text files can't report their position while they're being iterated over
+        with open(filename, "rb") as raw_file:
+            csv_file = io.TextIOWrapper(raw_file, encoding="UTF-8")
+            reader = csv.DictReader(csv_file)
+            yield from track_progress(
+                iter(lambda reader=reader: tuple(islice(reader, chunksize)), ()),
+                raw_file,
+                desc,
+            )
+        return
+
+    dataset = ds.dataset(filename, format="parquet", partitioning="hive")
+    for batch in tqdm(
+        dataset.to_batches(batch_size=chunksize),
+        desc=desc,
+        total=math.ceil(count_rows(filename) / chunksize),
+        leave=True,
+    ):
+        yield tuple(
+            {key: "" if val is None else val for key, val in row.items()}
+            for row in batch.to_pylist()
+        )
+
+
+@contextmanager
+def deferred_indexes():
+    """
+    drops the secondary indexes of the app's tables while loading, so they aren't
+    updated on every insert, and builds them again afterwards, whether or not the
+    load succeeds. Indexes sqlite makes for primary keys are kept. The tables are
+    analyzed at the end, so queries use the new indexes
+    """
+    tables = [
+        model._meta.db_table for model in apps.get_app_config("data").get_models()
+    ]
+    with connection.cursor() as cursor:
+        indexes = cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+            f"AND sql IS NOT NULL AND tbl_name IN ({', '.join(['%s'] * len(tables))})",
+            tables,
+        ).fetchall()
+        for name, _ in indexes:
+            cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+
+    try:
+        yield
+    finally:
+        # indexes are built again even if the load fails, since the rows loaded before
+        # the failure may already be committed
+        with connection.cursor() as cursor:
+            for name, sql in tqdm(indexes, desc="build indexes"):
+                cursor.execute(sql)
+            cursor.execute("ANALYZE")
+
+
+def load_files(input_format, raw=False):
+    """
+    loads each of LOADERS in order, in one transaction per file, and stores the
+    checksums of each year of each file for load_files_incrementally
+
+    Args:
+        input_format (str): format of the input files, csv or parquet
+        raw (bool, optional): insert rows from prepare_rows with executemany instead
+            of creating models. Rows are checksummed as they're inserted, where the
+            ORM load reads each file again to checksum it. Defaults to False.
+    """
+    loaded_keys.cache_clear()
+    for filename, loader in LOADERS.items():
+        with transaction.atomic():
+            if raw:
+                checksums = {}
+                for batch in iter_batches(filename, input_format):
+                    insert_rows(*batch)
+                    add_checksums(checksums, filename, batch[1])
+            else:
+                path = input_filename(filename, input_format)
+                for lines in read_chunks(path, pick_batch_size(path)):
+                    loader(lines)
+                checksums = partition_checksums(filename, input_format)
+
+            record_partitions(filename, checksums)
+        loaded_keys.cache_clear()
+
+
+def input_size(path):
+    """gets the number of bytes in a csv file or parquet dataset"""
+    if not is_parquet(path):
+        return os.path.getsize(path)
+
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def schedule(input_format):
+    """
+    orders LOADERS so each file comes after the files it depends on, and larger files
+    come first otherwise, so the largest file starts as early as possible
+
+    Args:
+        input_format (str): format of the input files, csv or parquet
+
+    Returns:
+        list: names of files in LOADERS
+    """
+
+    def depth(filename):
+        return 1 + max(map(depth, DEPENDENCIES.get(filename, [])), default=-1)
+
+    return sorted(
+        LOADERS,
+        key=lambda filename: (
+            depth(filename),
+            -input_size(input_filename(filename, input_format)),
+        ),
+    )
+
+
+def prepare_file(filename, input_format, queue):
+    """
+    reads a file in a worker process, and puts each batch of rows from prepare_rows
+    on the writer's queue, then a dict of the checksums of each year of the file,
+    followed by None once the file has been read
+
+    Args:
+        filename (str): name of file in LOADERS
+        input_format (str): format of the input files, csv or parquet
+        queue (multiprocessing.Queue): writer's queue
+    """
+    checksums = {}
+    try:
+        for batch in iter_batches(filename, input_format):
+            queue.put((filename, batch))
+            add_checksums(checksums, filename, batch[1])
+        queue.put((filename, checksums))
+    finally:
+        queue.put((filename, None))
+
+
+def check_workers(workers):
+    """raises if any worker process has exited with an error or been killed
+
+    Args:
+        workers (dict): worker processes, by the name of the file they read
+
+    Raises:
+        RuntimeError: if a worker exited with a nonzero exit code
+    """
+    for filename, worker in workers.items():
+        if worker.exitcode not in (None, 0):
+            raise RuntimeError(
+                f"worker reading {filename} exited with code {worker.exitcode}"
+            )
+
+
+def load_files_parallel(input_format, jobs):
+    """
+    reads and prepares the files in LOADERS in worker processes, and inserts their
+    rows from this process, since sqlite only allows one writer at a time. A file
+    isn't read until the files it depends on are inserted, so every batch can be
+    inserted as soon as it arrives. Everything is loaded in one transaction
+
+    Args:
+        input_format (str): format of the input files, csv or parquet
+        jobs (int): number of worker processes
+
+    Raises:
+        RuntimeError: if a worker exits with an error or is killed
+    """
+    loaded_keys.cache_clear()
+    pending = schedule(input_format)
+    workers = {}
+    inserted = set()
+    queue = multiprocessing.Queue(maxsize=jobs * 2)
+    try:
+        with transaction.atomic():
+            while len(inserted) < len(LOADERS):
+                # start the next files whose dependencies are inserted
+                for filename in list(pending):
+                    if len(workers) - len(inserted) >= jobs:
+                        break
+                    if inserted.issuperset(DEPENDENCIES.get(filename, [])):
+                        pending.remove(filename)
+                        workers[filename] = multiprocessing.Process(
+                            target=prepare_file,
+                            args=(filename, input_format, queue),
+                        )
+                        workers[filename].start()
+
+                try:
+                    filename, batch = queue.get(timeout=WORKER_POLL_SECONDS)
+                except Empty:
+                    check_workers(workers)
+                    continue
+
+                if isinstance(batch, dict):
+                    record_partitions(filename, batch)
+                    continue
+                if batch is not None:
+                    insert_rows(*batch)
+                    continue
+
+                workers[filename].join()
+                check_workers(workers)
+                inserted.add(filename)
+                loaded_keys.cache_clear()
+    finally:
+        for worker in workers.values():
+            if worker.is_alive():
+                worker.terminate()
+
+
+def row_checksum(row):
+    """hashes a row from prepare_rows to a 64-bit integer"""
+    return int.from_bytes(
+        hashlib.blake2b(repr(row).encode(), digest_size=8).digest(), "big"
+    )
+
+
+def column_index(model, name):
+    """gets the position of a field in rows from prepare_rows"""
+    return [field.name for field in model._meta.concrete_fields].index(name)
+
+
+def iter_batches(filename, input_format):
+    """reads a file in LOADERS in batches of rows from prepare_rows
+
+    Args:
+        filename (str): name of file in LOADERS
+        input_format (str): format of the input files, csv or parquet
+
+    Yields:
+        tuple: arguments of insert_rows
+    """
+    path = input_filename(filename, input_format)
+    for lines in read_chunks(path, pick_batch_size(path)):
+        yield LOADERS[filename](lines, prepare_rows)
+
+
+def add_checksums(checksums, filename, rows):
+    """
+    adds the checksums of rows to the sums for each year of a file. Sums don't depend
+    on the order of the rows, so a year's checksum only changes if its rows do
+
+    Args:
+        checksums (dict): tuple of checksum and number of rows, by year. Modified in
+            place
+        filename (str): name of file in LOADERS
+        rows (list): rows of the file from prepare_rows
+    """
+    model, year_col = PARTITIONS[filename]
+    year_index = column_index(model, year_col)
+    for row in rows:
+        checksum, n_rows = checksums.get(row[year_index], (0, 0))
+        checksums[row[year_index]] = (
+            (checksum + row_checksum(row)) % 2**64,
+            n_rows + 1,
+        )
+
+
+def partition_checksums(filename, input_format):
+    """sums the checksums of the rows in each year of a file
+
+    Args:
+        filename (str): name of file in LOADERS
+        input_format (str): format of the input files, csv or parquet
+
+    Returns:
+        dict: tuple of checksum and number of rows, by year
+    """
+    checksums = {}
+    for _, rows, _, _ in iter_batches(filename, input_format):
+        add_checksums(checksums, filename, rows)
+
+    return checksums
+
+
+def record_partitions(filename, checksums):
+    """replaces the stored checksums of each year of a file
+
+    Args:
+        filename (str): name of file in LOADERS
+        checksums (dict): output of partition_checksums
+    """
+    models.LoadedPartitions.objects.filter(filename=filename).delete()
+    models.LoadedPartitions.objects.bulk_create(
+        models.LoadedPartitions(
+            filename=filename,
+            year=year,
+            checksum=format(checksum, "016x"),
+            rows=n_rows,
+        )
+        for year, (checksum, n_rows) in checksums.items()
+    )
+
+
+def upsert_query(model):
+    """
+    gets a query that inserts a row of a model, or updates the row with the same
+    primary key if any of its values are different
+
+    Args:
+        model (django.db.models.Model): type of model to upsert
+
+    Returns:
+        str: INSERT query with an ON CONFLICT clause
+    """
+    query, _ = insert_plan(model)
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = [
+        quote_name(field.column)
+        for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+    return "{} ON CONFLICT ({}) DO UPDATE SET {} WHERE {}".format(
+        query,
+        quote_name(model._meta.pk.column),
+        ", ".join(f"{column} = excluded.{column}" for column in columns),
+        " OR ".join(f"{table}.{column} IS NOT excluded.{column}" for column in columns),
+    )
+
+
+def update_partitions(filename, input_format, changed, gone):
+    """
+    upserts the rows of a file in the years that changed, and deletes rows in those
+    years that aren't in the file anymore, along with every row in years that are
+    gone from the file. The primary keys of the rows kept and the years to delete
+    from are put in temporary tables, so the rows are deleted in one pass over the
+    table
+
+    Args:
+        filename (str): name of file in LOADERS
+        input_format (str): format of the input files, csv or parquet
+        changed (set): years with new, changed or deleted rows
+        gone (set): years that were loaded before but aren't in the file
+
+    Returns:
+        tuple: number of rows inserted or updated, and number of rows deleted
+    """
+    model, year_col = PARTITIONS[filename]
+    year_index = column_index(model, year_col)
+    pk_index = column_index(model, model._meta.pk.name)
+    query = upsert_query(model)
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk_column = connection.ops.quote_name(model._meta.pk.column)
+    year_column = connection.ops.quote_name(model._meta.get_field(year_col).column)
+
+    written, deleted = 0, 0
+    keep = set()
+    with connection.cursor() as cursor:
+        if changed:
+            for _, rows, fk_model, keys in iter_batches(filename, input_format):
+                in_changed = [row[year_index] in changed for row in rows]
+                rows = [row for row, include in zip(rows, in_changed) if include]
+                keys = [key for key, include in zip(keys, in_changed) if include]
+                if fk_model is not None:
+                    check_references(keys, fk_model)
+                cursor.executemany(query, rows)
+                written += max(cursor.rowcount, 0)
+                keep.update(row[pk_index] for row in rows)
+
+        if changed | gone:
+            cursor.execute("CREATE TEMP TABLE kept_keys (pk PRIMARY KEY)")
+            cursor.execute("CREATE TEMP TABLE stale_years (year)")
+            cursor.executemany(
+                "INSERT INTO kept_keys VALUES (%s)", [(pk,) for pk in keep]
+            )
+            cursor.executemany(
+                "INSERT INTO stale_years VALUES (%s)",
+                [(year,) for year in changed | gone],
+            )
+            # IS matches missing years, which IN doesn't
+            cursor.execute(
+                f"DELETE FROM {table} WHERE EXISTS (SELECT 1 FROM stale_years "
+                f"WHERE stale_years.year IS {table}.{year_column}) "
+                f"AND {pk_column} NOT IN (SELECT pk FROM kept_keys)"
+            )
+            deleted = cursor.rowcount
+            cursor.execute("DROP TABLE kept_keys")
+            cursor.execute("DROP TABLE stale_years")
+
+    return written, deleted
+
+
+def load_files_incrementally(input_format):
+    """
+    compares the checksums of each year of each file in LOADERS to the ones stored
+    when it was last loaded, and only writes the rows in years that changed, in one
+    transaction
+
+    Args:
+        input_format (str): format of the input files, csv or parquet
+
+    Returns:
+        dict: tuple of the number of years changed, rows inserted or updated and rows
+            deleted, by file
+    """
+    summary = {}
+    loaded_keys.cache_clear()
+    with transaction.atomic():
+        for filename in LOADERS:
+            checksums = partition_checksums(filename, input_format)
+            loaded = {
+                partition.year: partition.checksum
+                for partition in models.LoadedPartitions.objects.filter(
+                    filename=filename
+                )
+            }
+            changed = {
+                year
+                for year, (checksum, _) in checksums.items()
+                if loaded.get(year) != format(checksum, "016x")
+            }
+            gone = set(loaded) - set(checksums)
+            written, deleted = update_partitions(filename, input_format, changed, gone)
+            record_partitions(filename, checksums)
+            loaded_keys.cache_clear()
+            summary[filename] = (len(changed | gone), written, deleted)
+
+    return summary
+
 
 class Command(BaseCommand):
     """loads data from csv to database"""
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            choices=["csv", "parquet"],
+            default="csv",
+            help="format of the input files",
+        )
+        parser.add_argument(
+            "--raw",
+            action="store_true",
+            help="insert rows with executemany instead of creating models",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="number of processes that read files at the same time with --raw",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="only write rows in years that changed since the last load",
+        )
+
     def handle(self, *args, **options):
-        for filename, loader in LOADERS.items():
-            with open(filename, "r", encoding="UTF-8") as csv_file:
-                reader = csv.DictReader(csv_file)
-
-                for lines in tqdm(
-                    iter(
-                        lambda reader=reader: tuple(islice(reader, settings.CHUNKSIZE)),
-                        (),
-                    ),
-                    desc=f"load {filename}",
-                    total=guess_n_loops(filename, settings.CHUNKSIZE),
-                    leave=True,
-                ):
-                    loader(lines)
+        if options["incremental"]:
+            with load_pragmas():
+                summary = load_files_incrementally(options["format"])
+            for filename, (n_years, written, deleted) in summary.items():
+                self.stdout.write(
+                    f"{filename}: {n_years} years changed, {written} rows inserted or "
+                    f"updated, {deleted} rows deleted"
+                )
+        elif options["raw"] and options["jobs"] > 1:
+            with load_pragmas(), deferred_indexes():
+                load_files_parallel(options["format"], options["jobs"])
+        elif options["raw"]:
+            with load_pragmas(), deferred_indexes():
+                load_files(options["format"], raw=True)
+        else:
+            with deferred_indexes():
+                load_files(options["format"])
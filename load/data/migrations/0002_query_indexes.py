@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="agencies",
+            index=models.Index(
+                fields=[
+                    "data_year",
+                    "ori",
+                    "ucr_agency_name",
+                    "state_abbr",
+                    "population",
+                ],
+                name="agencies_year_ori",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reta",
+            index=models.Index(
+                fields=["ori_code", "card", "year", "value"],
+                name="reta_ori_card_year_value",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="shrincidents",
+            index=models.Index(
+                fields=["ori_code", "year"], name="shrincidents_ori_year"
+            ),
+        ),
+    ]
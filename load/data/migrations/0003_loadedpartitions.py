@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data", "0002_query_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LoadedPartitions",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("filename", models.CharField(max_length=255)),
+                ("year", models.IntegerField(null=True)),
+                ("checksum", models.CharField(max_length=16)),
+                ("rows", models.IntegerField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="loadedpartitions",
+            constraint=models.UniqueConstraint(
+                fields=("filename", "year"), name="loadedpartitions_filename_year"
+            ),
+        ),
+    ]
@@ -18,6 +18,16 @@ class RetA(models.Model):
     category = models.CharField(max_length=255)
     value = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            # covers totals grouped by ori_code, card and year in notebook/reta and
+            # notebook/murder_rate, so they're summed without reading the table
+            models.Index(
+                fields=["ori_code", "card", "year", "value"],
+                name="reta_ori_card_year_value",
+            ),
+        ]
+
 
 class Agencies(models.Model):
     """handles cleaned agency data"""
@@ -33,6 +43,22 @@ class Agencies(models.Model):
     msa_name = models.CharField(max_length=50)
     city_name = models.CharField(max_length=50)
 
+    class Meta:
+        indexes = [
+            # covers the agencies of one year selected in notebook/murder_rate, and
+            # finds agencies by year and ori for joins to reta and shr data
+            models.Index(
+                fields=[
+                    "data_year",
+                    "ori",
+                    "ucr_agency_name",
+                    "state_abbr",
+                    "population",
+                ],
+                name="agencies_year_ori",
+            ),
+        ]
+
 
 class SHRIncidents(models.Model):
     """handles cleaned SHR Incident data"""
@@ -44,6 +70,12 @@ class SHRIncidents(models.Model):
     homicide = models.CharField(max_length=1)
     situation = models.CharField(max_length=1)
 
+    class Meta:
+        indexes = [
+            # finds incidents by ori and year for joins to agencies
+            models.Index(fields=["ori_code", "year"], name="shrincidents_ori_year"),
+        ]
+
 
 class SHROffenders(models.Model):
     """handles cleaned SHR Offender data"""
@@ -76,3 +108,19 @@ class SHRVictims(models.Model):
     victim_ethnicity = models.CharField(max_length=10, null=True, blank=True)
     victim_race = models.CharField(max_length=10, null=True, blank=True)
     victim_sex = models.CharField(max_length=10, null=True, blank=True)
+
+
+class LoadedPartitions(models.Model):
+    """handles checksums of the rows loaded from each year of each input file"""
+
+    filename = models.CharField(max_length=255)
+    year = models.IntegerField(null=True)
+    checksum = models.CharField(max_length=16)
+    rows = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["filename", "year"], name="loadedpartitions_filename_year"
+            ),
+        ]
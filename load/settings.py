@@ -13,4 +13,15 @@ SECRET_KEY = "cbs9if+3z32gry6k)wh5#at8a4b316@#a9&w&u17z*80ukc+0l7=b"
 
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 
-CHUNKSIZE = 1000
+# megabytes of input rows read per bulk insert, unless MEMORY_BUDGET_MB is set. The
+# batch size is picked from this and the measured size of a sample of each file
+CHUNK_MEMORY_MB = 8
+
+# sqlite PRAGMAs set while running load_from_csv --raw, and restored afterwards. The
+# journal is kept in memory and sqlite doesn't wait for writes to reach the disk,
+# with a cache of up to 256 megabytes
+LOAD_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -256 * 1024,
+}
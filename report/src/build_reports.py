@@ -4,6 +4,7 @@ from datetime import datetime
 from io import StringIO
 import os
 import re
+import sys
 from textwrap import wrap
 import hvplot
 import jinja2
@@ -11,6 +12,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import yaml
+from columnar import read_table
 
 
 def query_dataframe(df, column=None, index_col=None, single_value=True, **kwargs):
@@ -68,6 +70,9 @@ def word_wrap_title(title):
     return "\n".join(wrap(title, 60))
 
 
+# agency data from transform/agencies, either a csv file or a parquet dataset
+AGENCIES_FILE = sys.argv[1] if len(sys.argv) > 1 else "input/agencies.csv"
+
 with open("hand/markets.yaml", "r", encoding="utf-8") as file:
     markets = yaml.load(file, Loader=yaml.CLoader)
 
@@ -119,13 +124,18 @@ class Report:
         """reads csv files and attaches to self"""
 
         for filename in os.listdir("input"):
+            if not filename.endswith(".csv"):
+                continue
             attrname = os.path.basename(filename).split(".")[0]
             self.__dict__[attrname] = pd.read_csv(f"input/{filename}", low_memory=False)
 
-        # do this manually
-        self.agencies = pd.read_csv("input/agencies.csv").query("data_year == 2020")[
-            ["ori", "state_abbr"]
-        ]
+        # do this manually, only reading the columns and year that are needed
+        self.agencies = read_table(
+            AGENCIES_FILE,
+            columns=["ori", "state_abbr"],
+            years=[2020],
+            partition_col="data_year",
+        )[["ori", "state_abbr"]]
 
     def write_local_shr_data(self):
         write_args = {"index": False}
@@ -1,10 +1,14 @@
-"""downloads supplementary homicide report documents from 1995-present to raw"""
+"""downloads FBI master files from 1995-present and agency data to raw"""
 
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
+import re
 import subprocess
-from remotezip import RemoteZip
+import zipfile
 import requests
 from tqdm import tqdm
+from manifest import file_hash, read_manifest, write_manifest
 
 BASE_URL = (
     "https://s3-us-gov-west-1.amazonaws.com/cg-d4b776d0-d898-4153-90c8-8336f86bdfec"
@@ -12,63 +16,288 @@ BASE_URL = (
 
 FILES = ["reta", "shr", "nibrs"]
 
+YEARS = range(1995, 2021)
 
-def download_zip(url, dirname):
-    """downloads and extracts all files in zip file at url to dirname"""
-    # the zipfile module only supports CRC32-encrypted zip files, but some older FBI files
-    # use other, unsupported encryption methods. Attempt to unzip the files with default
-    # encryption, then use 7zip if that fails
-    attempts = 0
-    while attempts < 3:
-        try:
-            with RemoteZip(url) as remote_zip:
-                for zipped_file in remote_zip.infolist():
-                    if not os.path.exists(f"{dirname}/{zipped_file.filename}"):
-                        remote_zip.extract(zipped_file, dirname)
+# zip files are downloaded here, then extracted to the folder for their dataset
+DOWNLOAD_DIR = "raw/downloads"
 
-        except NotImplementedError:
-            attempts += 1
-            print(f"reading zip file from remote failed. retrying {attempts}/3")
+# number of bytes read from the connection at a time. Bytes read are written to disk
+# as they arrive, so little is lost when a connection drops
+CHUNKSIZE = 1 << 16
+
+# number of times an interrupted download is resumed before giving up
+RETRIES = 3
+
+# seconds to wait for the server to respond
+TIMEOUT = 60
+
+
+def download_targets(base_url):
+    """lists the zip files to download
+
+    Args:
+        base_url (str): url of the bucket the files are in
+
+    Returns:
+        list: tuples of url, path to download to and directory to extract to
+    """
+    targets = []
+    for year in YEARS:
+        for fbi_file in FILES:
+            # all urls use the same format
+            targets.append(
+                (
+                    f"{base_url}/masters/{fbi_file}/{fbi_file}-{year}.zip",
+                    f"{DOWNLOAD_DIR}/{fbi_file}-{year}.zip",
+                    f"raw/{fbi_file}",
+                )
+            )
+
+    targets.append(
+        (f"{base_url}/agencies.zip", f"{DOWNLOAD_DIR}/agencies.zip", "raw/agencies")
+    )
+    return targets
+
+
+def is_downloaded(filename, entry, verify=False):
+    """checks a downloaded file against its manifest entry, without any requests
+
+    Args:
+        filename (str): path to downloaded file
+        entry (dict | None): manifest entry of file, None if it isn't in the manifest
+        verify (bool, optional): also compare the sha256 hash of the file. Defaults
+            to False, which only compares sizes.
+
+    Returns:
+        bool: whether the file is complete
+    """
+    if entry is None or not os.path.exists(filename):
+        return False
+
+    if os.path.getsize(filename) != entry["size"]:
+        return False
+
+    return not verify or file_hash(filename) == entry["sha256"]
+
+
+def total_size(resp, offset):
+    """
+    reads the full size of a file from a response, which only contains the part
+    after offset if it's a range response
+
+    Returns:
+        int | None: size in bytes, or None if the server didn't send it
+    """
+    content_range = re.search(r"/(\d+)$", resp.headers.get("Content-Range", ""))
+    if content_range is not None:
+        return int(content_range.group(1))
+
+    if "Content-Length" in resp.headers:
+        return int(resp.headers["Content-Length"]) + offset
+
+    return None
+
+
+def response_validator(resp):
+    """gets the ETag of a response, or its Last-Modified date if it has no ETag"""
+    return resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+
+
+def read_validator(part_filename):
+    """reads the validator saved with a partial download, None if there isn't one"""
+    try:
+        with open(f"{part_filename}.validator", encoding="utf-8") as validator_file:
+            return validator_file.read() or None
+    except FileNotFoundError:
+        return None
 
-        else:
-            break
 
+def remove_partial(part_filename):
+    """deletes a partial download and its validator, if they exist"""
+    for filename in [part_filename, f"{part_filename}.validator"]:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def fetch(url, part_filename):
+    """
+    streams url to part_filename. If part_filename already has data from an earlier
+    attempt, only the rest of the file is requested with a Range header. The ETag or
+    Last-Modified date of the file is saved next to part_filename and sent with an
+    If-Range header, so the server sends the whole file again if it has changed
+
+    Args:
+        url (str): url of file
+        part_filename (str): path to write to
+
+    Raises:
+        ValueError: if the server responds with an error
+
+    Returns:
+        int | None: full size of the file in bytes, if the server sent it
+    """
+    offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+    validator = read_validator(part_filename)
+    if offset > 0 and validator is not None:
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator}
     else:
-        print("reading zip file from remote url failed. retrying with 7zip.")
+        # without a validator there's no way to tell if the partial file is from the
+        # current version of the file, so it's downloaded again
+        offset, headers = 0, {}
+
+    with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as resp:
+        if resp.status_code == 416:
+            # the range starts at or after the end of the file
+            return total_size(resp, offset)
+
+        if resp.status_code == 206:
+            mode = "ab"
+        elif resp.status_code == 200:
+            # the server sent the whole file, because it ignored the Range header or
+            # the file changed since the partial file was downloaded
+            mode, offset = "wb", 0
+            remove_partial(part_filename)
+            if response_validator(resp) is not None:
+                with open(
+                    f"{part_filename}.validator", "w", encoding="utf-8"
+                ) as validator_file:
+                    validator_file.write(response_validator(resp))
+        else:
+            raise ValueError(f"{url} returned status code {resp.status_code}")
 
-        resp = requests.get(url)
-        if resp.status_code != 200:
-            raise ValueError(f"request returned status code {resp.status_code}")
+        with open(part_filename, mode) as part_file:
+            for chunk in resp.iter_content(CHUNKSIZE):
+                part_file.write(chunk)
 
+        return total_size(resp, offset)
+
+
+def download_file(url, filename):
+    """
+    downloads url to filename, resuming after connection errors. The file is written
+    to filename + '.part' until it's complete, so a download interrupted by stopping
+    the script is resumed the next time it's run
+
+    Args:
+        url (str): url of file
+        filename (str): path to download to
+
+    Raises:
+        ValueError: if the file is incomplete after all retries, or the server
+            responds with an error
+
+    Returns:
+        dict: manifest entry with the url, size and sha256 hash of the file
+    """
+    part_filename = f"{filename}.part"
+    for attempt in range(RETRIES + 1):
         try:
-            temp_filename = "response-temp.zip"
-            with open(temp_filename, "wb") as zip_file:
-                zip_file.write(resp.content)
-
-            subprocess.call(
-                [
-                    "7z",
-                    "x",
-                    "-ppassword",
-                    f"-o{dirname}",
-                    temp_filename,
-                ]
-            )
+            size = fetch(url, part_filename)
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ):
+            if attempt == RETRIES:
+                raise
+            continue
+
+        if size is not None and os.path.getsize(part_filename) > size:
+            # the partial file doesn't belong to the current file, start over
+            remove_partial(part_filename)
+        elif size is None or os.path.getsize(part_filename) == size:
+            break
+    else:
+        raise ValueError(f"download of {url} incomplete after {RETRIES} retries")
+
+    os.replace(part_filename, filename)
+    remove_partial(part_filename)
+    return {
+        "url": url,
+        "size": os.path.getsize(filename),
+        "sha256": file_hash(filename),
+    }
+
+
+def extract_zip(filename, dirname):
+    """extracts all files in a zip file to dirname, skipping files that exist"""
+    # the zipfile module only supports CRC32-encrypted zip files, but some older FBI files
+    # use other, unsupported encryption methods. Attempt to unzip the files with default
+    # encryption, then use 7zip if that fails
+    try:
+        with zipfile.ZipFile(filename) as zip_file:
+            for zipped_file in zip_file.infolist():
+                if not os.path.exists(f"{dirname}/{zipped_file.filename}"):
+                    zip_file.extract(zipped_file, dirname)
 
-        finally:
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
+    except (NotImplementedError, RuntimeError):
+        print(f"unzipping {filename} failed. retrying with 7zip.")
+        subprocess.call(["7z", "x", "-ppassword", "-y", f"-o{dirname}", filename])
+
+
+def parse_args():
+    """parses command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--base-url", default=BASE_URL, help="url of the bucket to download from"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=4, help="number of files to download at once"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check the sha256 hash of downloaded files, not just their size",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    # download masters
-    for year in tqdm(range(1995, 2021), desc="Download files", leave=False):
-        for fbi_file in FILES:
-            # all urls use the same format
-            file_url = f"{BASE_URL}/masters/{fbi_file}/{fbi_file}-{year}.zip"
-            file_dirname = f"raw/{fbi_file}"
+    args = parse_args()
+
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    manifest = read_manifest(DOWNLOAD_DIR)
+    targets = download_targets(args.base_url)
+
+    # completed files are skipped without contacting the server
+    pending = [
+        (url, filename)
+        for url, filename, _ in targets
+        if not is_downloaded(
+            filename, manifest.get(os.path.basename(filename)), args.verify
+        )
+    ]
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(download_file, url, filename): filename
+            for url, filename in pending
+        }
+        for future in tqdm(
+            as_completed(futures),
+            desc="Download files",
+            total=len(futures),
+            leave=False,
+        ):
+            filename = futures[future]
+            try:
+                manifest[os.path.basename(filename)] = future.result()
+            except (requests.RequestException, ValueError) as err:
+                errors.append(f"{filename}: {err}")
+            else:
+                # saved after every file, so progress survives an interruption
+                write_manifest(DOWNLOAD_DIR, manifest)
 
-            download_zip(file_url, file_dirname)
+    for _, filename, dirname in tqdm(targets, desc="Extract files", leave=False):
+        if os.path.exists(filename):
+            try:
+                extract_zip(filename, dirname)
+            except zipfile.BadZipFile as err:
+                errors.append(f"{filename}: {err}")
+                # downloaded again on the next run
+                manifest.pop(os.path.basename(filename), None)
+                write_manifest(DOWNLOAD_DIR, manifest)
 
-    # download agencies
-    download_zip(f"{BASE_URL}/agencies.zip", "raw/agencies")
+    if len(errors) > 0:
+        raise SystemExit("failed to download:\n" + "\n".join(errors))
@@ -3,6 +3,26 @@
 import hashlib
 
 
+def join_fields(df, fieldnames):
+    """
+    joins the values of fieldnames in each row with '-', with each value formatted
+    exactly as str(row[fieldname]) formats it when using df.apply(axis=1), without
+    building a series for each row
+
+    Args:
+        df (pandas.DataFrame): dataframe containing fieldnames
+        fieldnames (tuple): column names to join
+
+    Returns:
+        list: one joined string per row
+    """
+    # df.apply(axis=1) casts every value to the common dtype of all columns in df,
+    # e.g. ints in a frame of ints and floats are formatted like '1995.0'
+    dtype = df.iloc[:0].to_numpy().dtype
+    columns = [df[fieldname].to_numpy(dtype=dtype) for fieldname in fieldnames]
+    return ["-".join(map(str, values)) for values in zip(*columns)]
+
+
 def assign_unique_ids(df, *fieldnames):
     """assigns unique identifiers to each row in dataframe based on fields in fieldnames
 
@@ -15,25 +35,21 @@ def assign_unique_ids(df, *fieldnames):
     """
     assert len(fieldnames) > 0, "You must provide at least one field"
 
-    df["unique_id"] = df.apply(
-        lambda row: hashlib.sha1(
-            str.encode("-".join([str(row[fieldname]) for fieldname in fieldnames]))
-        ).hexdigest(),
-        axis=1,
-    )
+    df["unique_id"] = [
+        hashlib.sha1(str.encode(key)).hexdigest() for key in join_fields(df, fieldnames)
+    ]
 
     # put unique id first
     df = df[
         ["unique_id"] + list(filter(lambda c: c != "unique_id", df.columns.tolist()))
     ]
 
-    # check output
-    found_rows = df.unique_id.nunique()
-    expected_rows = len(df)
-    if not found_rows == expected_rows:
-        non_unique_ids = df[
-            df.unique_id.duplicated() == True  # pylint: disable=singleton-comparison
-        ].unique_id.unique()
+    # check output. Only one pass over the ids is needed when they're all unique
+    duplicated = df.unique_id.duplicated()
+    if duplicated.any():
+        found_rows = len(df) - duplicated.sum()
+        expected_rows = len(df)
+        non_unique_ids = df.unique_id[duplicated].unique()
         df[df.unique_id.isin(non_unique_ids)].to_csv(
             "output/dupe_rows.csv", index=False
         )
@@ -0,0 +1,78 @@
+"""
+contains functions for picking how many rows to read at a time from a memory budget,
+and for tracking progress through a file by byte offset instead of counting its lines
+before reading it
+"""
+
+import os
+from tqdm import tqdm
+
+# environment variable with the number of megabytes a chunk may use in memory
+BUDGET_VARIABLE = "MEMORY_BUDGET_MB"
+
+# number of rows read to measure how much memory each row takes
+SAMPLE_ROWS = 100
+
+
+def memory_budget(default_mb):
+    """reads the memory budget for a chunk of rows
+
+    Args:
+        default_mb (int): budget in megabytes if MEMORY_BUDGET_MB isn't set
+
+    Returns:
+        int: budget in bytes
+    """
+    return int(float(os.environ.get(BUDGET_VARIABLE, default_mb)) * 1024**2)
+
+
+def bytes_per_row(*dfs):
+    """measures the memory used by each row of a sample
+
+    Args:
+        *dfs (pandas.DataFrame): sample, and any dataframes made from it that are in
+            memory at the same time, e.g. the sample reshaped to long format
+
+    Returns:
+        float: bytes in memory per row of the first dataframe
+    """
+    total_bytes = sum(df.memory_usage(deep=True).sum() for df in dfs)
+    return total_bytes / max(len(dfs[0]), 1)
+
+
+def pick_chunksize(row_bytes, budget):
+    """picks the number of rows per chunk that keeps chunks within budget
+
+    Args:
+        row_bytes (float): output of bytes_per_row
+        budget (int): output of memory_budget
+
+    Returns:
+        int: number of rows per chunk, at least 1
+    """
+    return max(int(budget // max(row_bytes, 1)), 1)
+
+
+def track_progress(chunks, in_file, desc):
+    """
+    yields chunks read from in_file, with a progress bar that tracks how many bytes of
+    in_file have been read, so the file's lines don't need to be counted first
+
+    Args:
+        chunks (iterable): chunks read from in_file
+        in_file (file): binary file that chunks are read from
+        desc (str): description of progress bar
+
+    Yields:
+        same as chunks
+    """
+    with tqdm(
+        total=os.fstat(in_file.fileno()).st_size,
+        desc=desc,
+        unit="B",
+        unit_scale=True,
+        leave=False,
+    ) as progress:
+        for chunk in chunks:
+            progress.update(in_file.tell() - progress.n)
+            yield chunk
@@ -0,0 +1,190 @@
+"""
+contains functions for reading and writing files handed off between tasks, either as
+csv files or as parquet datasets partitioned by year. Which format is used depends on
+the extension of the path: '.parquet' paths are directories of parquet files with one
+subdirectory per year, e.g. reta_master.parquet/year=1995/part-00000-0.parquet
+"""
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# directory name hive partitioning reads back as a null partition value
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def is_parquet(path):
+    """checks whether path refers to a parquet dataset"""
+    return path.rstrip("/").endswith(".parquet")
+
+
+def clear_dataset(path):
+    """deletes a parquet dataset or csv file if it exists"""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def write_partition(table, path, partition_col, part_number):
+    """writes an arrow table to a parquet dataset, one file per value of partition_col
+
+    Args:
+        table (pyarrow.Table): table to write
+        path (str): path to dataset directory
+        partition_col (str): name of column to partition on. It's stored in the
+            directory names and dropped from the files.
+        part_number (int): number used to name the files, so that writing parts
+            in order and reading them back keeps the order of the rows
+    """
+    # each partition is written with pq.write_table rather than pq.write_to_dataset,
+    # whose background writer can abort the interpreter at exit
+    for value in pc.unique(table[partition_col]).to_pylist():
+        if value is None:
+            mask = pc.is_null(table[partition_col])
+            dirname = f"{path}/{partition_col}={NULL_PARTITION}"
+        else:
+            mask = pc.equal(table[partition_col], value)
+            dirname = f"{path}/{partition_col}={value}"
+
+        os.makedirs(dirname, exist_ok=True)
+        pq.write_table(
+            table.filter(mask).drop([partition_col]),
+            f"{dirname}/part-{part_number:05d}-0.parquet",
+        )
+
+
+def write_table(
+    df, path, partition_col="year", schema=None, part_number=0, append=False
+):
+    """writes a dataframe as csv or as a parquet dataset partitioned by partition_col
+
+    Args:
+        df (pandas.DataFrame): dataframe to write
+        path (str): path to csv file or parquet dataset
+        partition_col (str, optional): column to partition parquet datasets on.
+            Defaults to "year".
+        schema (pyarrow.Schema, optional): arrow schema of the parquet files.
+            Defaults to None, which infers it from the dtypes of df.
+        part_number (int, optional): number of this part when writing a dataset in
+            several parts. Defaults to 0.
+        append (bool, optional): add to existing data instead of replacing it.
+            Defaults to False.
+    """
+    if not append:
+        clear_dataset(path)
+
+    if not is_parquet(path):
+        df.to_csv(path, index=False, mode="a" if append else "w", header=not append)
+        return
+
+    # columns with mixed types are written as text, the same way to_csv would. Columns
+    # that only have strings are converted by arrow as they are
+    mixed = [
+        col
+        for col in df.columns[df.dtypes == object]
+        if pd.api.types.infer_dtype(df[col], skipna=True) != "string"
+    ]
+    if len(mixed) > 0:
+        df = df.copy()
+        for col in mixed:
+            df[col] = df[col].astype(str).mask(df[col].isna())
+
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    write_partition(table, path, partition_col, part_number)
+
+
+def dataset_columns(path):
+    """gets the column names of a csv file or parquet dataset without reading it"""
+    if is_parquet(path):
+        return ds.dataset(path, format="parquet", partitioning="hive").schema.names
+
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def to_pandas(table):
+    """converts an arrow table to a dataframe with NaN for missing strings, like csv"""
+    df = table.to_pandas()
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notna(), np.NaN)
+    return df
+
+
+def count_rows(path):
+    """counts the rows of a parquet dataset from its metadata"""
+    return ds.dataset(path, format="parquet", partitioning="hive").count_rows()
+
+
+def year_filter(partition_col, years):
+    """builds an arrow expression that keeps only rows from years"""
+    return ds.field(partition_col).isin(list(years))
+
+
+def read_table(path, columns=None, years=None, partition_col="year", **csv_kwargs):
+    """reads a csv file or parquet dataset to a dataframe
+
+    Args:
+        path (str): path to csv file or parquet dataset
+        columns (list, optional): columns to read. Defaults to None, which reads all.
+        years (list, optional): years to read. Defaults to None, which reads all.
+            For parquet datasets only the matching partitions are read.
+        partition_col (str, optional): name of the year column. Defaults to "year".
+        **csv_kwargs: keyword arguments passed to pandas.read_csv for csv files
+
+    Returns:
+        pandas.DataFrame: dataframe
+    """
+    if is_parquet(path):
+        return to_pandas(
+            ds.dataset(path, format="parquet", partitioning="hive").to_table(
+                columns=columns,
+                filter=None if years is None else year_filter(partition_col, years),
+            )
+        )
+
+    if columns is None or years is None or partition_col in columns:
+        df = pd.read_csv(path, usecols=columns, **csv_kwargs)
+    else:
+        df = pd.read_csv(path, usecols=columns + [partition_col], **csv_kwargs)
+
+    if years is not None:
+        df = df.loc[df[partition_col].isin(years)]
+    return df if columns is None else df[columns]
+
+
+def iter_tables(path, chunksize, columns=None, **csv_kwargs):
+    """reads a csv file or parquet dataset in chunks
+
+    Args:
+        path (str): path to csv file or parquet dataset
+        chunksize (int): number of rows per chunk
+        columns (list, optional): columns to read. Defaults to None, which reads all.
+        **csv_kwargs: keyword arguments passed to pandas.read_csv for csv files
+
+    Yields:
+        pandas.DataFrame: chunks of chunksize rows, except possibly the last one
+    """
+    if not is_parquet(path):
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns, **csv_kwargs)
+        return
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    pending = []
+    n_pending = 0
+    for batch in dataset.to_batches(columns=columns, batch_size=chunksize):
+        pending.append(batch)
+        n_pending += batch.num_rows
+        # batches end at file boundaries, so regroup them into whole chunks
+        while n_pending >= chunksize:
+            table = pa.Table.from_batches(pending)
+            yield to_pandas(table.slice(0, chunksize))
+            pending = table.slice(chunksize).to_batches()
+            n_pending -= chunksize
+
+    if n_pending > 0:
+        yield to_pandas(pa.Table.from_batches(pending))
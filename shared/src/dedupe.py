@@ -0,0 +1,81 @@
+"""
+contains a compact set of the keys written so far when writing a file in chunks, so
+rows that repeat a key from an earlier chunk can be dropped in a single pass
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def hash_values(obj):
+    """hashes each value of a series, or each row of a dataframe, to a 64-bit integer"""
+    return pd.util.hash_pandas_object(obj, index=False).to_numpy()
+
+
+class SeenKeys:
+    """
+    keeps a 64-bit hash of each key written so far, along with a 64-bit hash of the
+    row it was written with. Hashes are kept in sorted numpy arrays, which take 16
+    bytes per key, where a python set of the keys would take over 100.
+
+    Each add appends a sorted run, and runs are merged whenever the newest one is at
+    least as long as the one before it, like the carries of a binary counter. Each
+    key is merged O(log n) times and there are O(log n) runs to search, where
+    inserting into a single sorted array would copy every key on every add
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(len(keys) for keys, _ in self.runs)
+
+    def lookup(self, keys, rows):
+        """finds which keys were seen before, and which of those were seen with a
+        different row
+
+        Args:
+            keys (numpy.ndarray): hashes of unique keys, from hash_values
+            rows (numpy.ndarray): hashes of the rows of keys, from hash_values
+
+        Returns:
+            tuple: boolean arrays of keys that were seen, and of keys that were seen
+                with a different row
+        """
+        # searching for keys in order touches each run in order, which is much faster
+        # than jumping around a long run
+        order = np.argsort(keys)
+        keys, rows = keys[order], rows[order]
+        seen = np.zeros(len(keys), dtype=bool)
+        changed = np.zeros(len(keys), dtype=bool)
+        for run_keys, run_rows in self.runs:
+            positions = np.minimum(np.searchsorted(run_keys, keys), len(run_keys) - 1)
+            found = run_keys[positions] == keys
+            seen |= found
+            changed |= found & (run_rows[positions] != rows)
+
+        # put the results back in the order of keys
+        unsorted = np.empty((2, len(keys)), dtype=bool)
+        unsorted[:, order] = seen, changed
+        return unsorted[0], unsorted[1]
+
+    def add(self, keys, rows):
+        """adds keys that weren't seen before, and the hashes of their rows
+
+        Args:
+            keys (numpy.ndarray): hashes of unique keys, from hash_values
+            rows (numpy.ndarray): hashes of the rows of keys, from hash_values
+        """
+        if len(keys) == 0:
+            return
+
+        order = np.argsort(keys, kind="stable")
+        self.runs.append((keys[order], rows[order]))
+        while len(self.runs) > 1 and len(self.runs[-1][0]) >= len(self.runs[-2][0]):
+            newer_keys, newer_rows = self.runs.pop()
+            older_keys, older_rows = self.runs.pop()
+            merged_keys = np.concatenate([older_keys, newer_keys])
+            order = np.argsort(merged_keys, kind="stable")
+            self.runs.append(
+                (merged_keys[order], np.concatenate([older_rows, newer_rows])[order])
+            )
@@ -0,0 +1,306 @@
+"""
+extracts yearly fixed-width files to a single csv file or parquet dataset, keeping
+only the columns matched by the patterns in an optional yaml file
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import csv
+import logging
+import os
+import shutil
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+import yaml
+from columnar import clear_dataset, is_parquet, write_partition
+from fwf import (
+    build_plan,
+    extract_file,
+    iter_records,
+    read_schema,
+    read_year,
+    sort_by_year,
+)
+from manifest import (
+    fragment_path,
+    hash_files,
+    is_cached,
+    options_key,
+    prune_cache,
+    read_manifest,
+    write_manifest,
+)
+
+# name of the column parquet datasets are partitioned on. Each file's raw 'year'
+# column is a 2-digit string, so the 4-digit year of the file is stored separately
+PARTITION_COL = "data_year"
+
+logging.basicConfig(filename="output/extract.log", filemode="w", level=logging.INFO)
+
+
+def read_patterns(yaml_filename):
+    """reads a yaml file containing a list of column regex patterns
+
+    Args:
+        yaml_filename (str): path to yaml file
+
+    Raises:
+        ValueError: if the yaml file isn't read as a list
+
+    Returns:
+        list: list of regex patterns
+    """
+    with open(yaml_filename, "r", encoding="UTF-8") as yaml_file:
+        patterns = yaml.load(yaml_file, Loader=yaml.CLoader)
+        if not isinstance(patterns, list):
+            raise ValueError(
+                f"malformed yaml file. must be a list, got {type(patterns)}"
+            )
+
+    return patterns
+
+
+def extract_fragment(filename, plan, fragment_filename, encoding="utf-8"):
+    """extracts a single fixed-width file to a csv file without a header
+
+    Args:
+        filename (str): path to fixed-width file
+        plan (fwf.Plan): output of fwf.build_plan
+        fragment_filename (str): path to write csv to
+        encoding (str, optional): encoding of file. Defaults to "utf-8".
+
+    Returns:
+        int: number of rows written
+    """
+    with open(fragment_filename, "w", encoding="utf-8", newline="") as fragment_file:
+        writer = csv.writer(fragment_file, lineterminator="\n")
+        return extract_file(filename, plan, writer, encoding)
+
+
+def partition_table(filename, plan, year, encoding="utf-8"):
+    """
+    extracts a single fixed-width file to an arrow table. All columns are stored as
+    strings, with nulls for empty values
+
+    Args:
+        filename (str): path to fixed-width file
+        plan (fwf.Plan): output of fwf.build_plan
+        year (int | None): 4-digit year of the file, stored in the partition column
+        encoding (str, optional): encoding of file. Defaults to "utf-8".
+
+    Returns:
+        pyarrow.Table: table with the planned columns and the partition column
+    """
+    with open(filename, "r", encoding=encoding, newline="") as fwf_file:
+        rows = list(iter_records(fwf_file, plan))
+
+    columns = zip(*rows) if len(rows) > 0 else [[] for _ in plan.columns]
+    arrays = [
+        pa.array([None if value == "" else value for value in values], pa.string())
+        for values in columns
+    ]
+    arrays.append(pa.array([year] * len(rows), pa.int16()))
+
+    return pa.Table.from_arrays(arrays, names=plan.columns + [PARTITION_COL])
+
+
+def cache_fragment(filename, plan, fragment, year, encoding="utf-8"):
+    """
+    extracts a single fixed-width file to a cached fragment: a csv file without a
+    header, or a parquet file that includes the partition column. The fragment is
+    written under a temporary name first, so an interrupted run can't leave a
+    partial fragment behind
+
+    Args:
+        filename (str): path to fixed-width file
+        plan (fwf.Plan): output of fwf.build_plan
+        fragment (str): path to fragment, ending with .csv or .parquet
+        year (int | None): 4-digit year of the file
+        encoding (str, optional): encoding of file. Defaults to "utf-8".
+
+    Returns:
+        int: number of rows written
+    """
+    temp_fragment = f"{fragment}.tmp"
+    if is_parquet(fragment):
+        table = partition_table(filename, plan, year, encoding)
+        pq.write_table(table, temp_fragment)
+        n_rows = table.num_rows
+    else:
+        n_rows = extract_fragment(filename, plan, temp_fragment, encoding)
+
+    os.replace(temp_fragment, fragment)
+    return n_rows
+
+
+def splice_fragments(results, plan, output):
+    """
+    combines cached fragments into a csv file or parquet dataset, in the order they're
+    yielded by results. Each fragment is spliced as soon as it's yielded, so splicing
+    overlaps with extracting the files after it. Nothing is parsed, so this costs
+    little more than copying the files
+
+    Args:
+        results (iterable): tuples of filename, path to fragment written by
+            cache_fragment and number of rows in it
+        plan (fwf.Plan): output of fwf.build_plan
+        output (str): path to output csv or parquet dataset
+
+    Yields:
+        tuple: filename and number of rows written, after its fragment is spliced
+    """
+    if is_parquet(output):
+        clear_dataset(output)
+        for i, (filename, fragment, n_rows) in enumerate(results):
+            write_partition(pq.read_table(fragment), output, PARTITION_COL, i)
+            yield filename, n_rows
+        return
+
+    with open(output, "w", encoding="utf-8", newline="") as output_file:
+        csv.writer(output_file, lineterminator="\n").writerow(plan.columns)
+        for filename, fragment, n_rows in results:
+            with open(fragment, "r", encoding="utf-8", newline="") as fragment_file:
+                shutil.copyfileobj(fragment_file, output_file)
+            yield filename, n_rows
+
+
+def extract_cached(
+    filenames, plan, schema, output, cache_dir=None, encoding="utf-8", jobs=1
+):
+    """
+    extracts only the files whose content has no fragment in cache_dir yet, and
+    splices the fragments of every file into output. With more than one job, files
+    are extracted on a process pool, and each file is spliced as soon as it and every
+    file before it are done, so splicing overlaps with extraction. Without a
+    cache_dir, every file is extracted to a temporary directory
+
+    Yields:
+        tuple: filename and number of rows written, in the order of filenames
+    """
+    if cache_dir is None:
+        with tempfile.TemporaryDirectory(dir="output") as temp_dir:
+            yield from extract_cached(
+                filenames, plan, schema, output, temp_dir, encoding, jobs
+            )
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = hash_files(filenames, read_manifest(cache_dir))
+    extension = "parquet" if is_parquet(output) else "csv"
+    # fragments made with other columns, encodings or formats are never reused
+    key = options_key(plan, encoding, extension)
+    fragments = [
+        fragment_path(cache_dir, manifest[filename], key, extension)
+        for filename in filenames
+    ]
+
+    tasks = {}
+    for filename, fragment in zip(filenames, fragments):
+        if is_cached(manifest[filename], fragment):
+            logging.info("reusing cached fragment of unchanged file %s", filename)
+        else:
+            year = read_year(filename, schema, encoding)
+            tasks[filename] = (filename, plan, fragment, year, encoding)
+
+    with (
+        nullcontext() if jobs == 1 else ProcessPoolExecutor(max_workers=jobs or None)
+    ) as executor:
+        futures = {}
+        if executor is not None:
+            futures = {
+                filename: executor.submit(cache_fragment, *task)
+                for filename, task in tasks.items()
+            }
+
+        def results():
+            for filename, fragment in zip(filenames, fragments):
+                if filename in futures:
+                    manifest[filename]["n_rows"] = futures[filename].result()
+                elif filename in tasks:
+                    manifest[filename]["n_rows"] = cache_fragment(*tasks[filename])
+                yield filename, fragment, manifest[filename]["n_rows"]
+
+        yield from splice_fragments(results(), plan, output)
+
+    write_manifest(cache_dir, manifest)
+    prune_cache(cache_dir, manifest)
+
+
+def log_results(results, n_files):
+    """logs the number of rows extracted from each file
+
+    Args:
+        results (iterable): tuples of filename and number of rows written
+        n_files (int): number of files being extracted
+
+    Returns:
+        int: total number of rows written
+    """
+    total_rows = 0
+    for filename, n_rows in tqdm(
+        results, desc="extract files", total=n_files, leave=False
+    ):
+        total_rows += n_rows
+        logging.info("extracted %s rows from %s", n_rows, filename)
+
+    return total_rows
+
+
+def parse_args():
+    """parses command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="+", help="fixed-width files to extract")
+    parser.add_argument("--schema", required=True, help="path to fwf-schema.csv")
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="path to output csv, or to a parquet dataset if it ends with .parquet",
+    )
+    parser.add_argument(
+        "--columns",
+        help="yaml file with a list of regex patterns of columns to keep. "
+        "Keeps all columns if not provided",
+    )
+    parser.add_argument(
+        "--cache",
+        help="directory to cache extracted files in. Only files whose content isn't "
+        "cached are extracted, the rest are copied from the cache. Files are extracted "
+        "to a temporary directory if not provided",
+    )
+    parser.add_argument("--encoding", default="utf-8", help="encoding of input files")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes. 1 extracts files serially, 0 uses all cores",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    schema = read_schema(args.schema)
+    plan = build_plan(
+        schema,
+        None if args.columns is None else read_patterns(args.columns),
+    )
+    # output is always in year order, regardless of the number of jobs
+    files = sort_by_year(args.files, schema, args.encoding)
+
+    total_rows = log_results(
+        extract_cached(
+            files, plan, schema, args.output, args.cache, args.encoding, args.jobs
+        ),
+        len(files),
+    )
+
+    logging.info(
+        "Successfully extracted and merged %s rows and %s columns to %s",
+        total_rows,
+        len(plan.columns),
+        args.output,
+    )
@@ -0,0 +1,144 @@
+"""contains functions for parsing fixed-width files described by hand/fwf-schema.csv"""
+
+import csv
+from collections import namedtuple
+from operator import itemgetter
+import re
+
+# a parsing plan: the output column names and the offsets of each column in a record
+Plan = namedtuple("Plan", ["columns", "slices"])
+
+
+def read_schema(schema_filename):
+    """reads a csvkit-style fixed-width schema file
+
+    Args:
+        schema_filename (str): path to a csv file with start, length and column fields
+
+    Returns:
+        list: list of (column, start, length) tuples, with 0-indexed start positions
+    """
+    with open(schema_filename, "r", encoding="utf-8") as schema_file:
+        rows = list(csv.DictReader(schema_file))
+
+    # same rule as csvkit: the schema is 1-indexed if the first column starts at 1
+    offset = 1 if int(rows[0]["start"]) == 1 else 0
+
+    return [
+        (row["column"], int(row["start"]) - offset, int(row["length"])) for row in rows
+    ]
+
+
+def build_plan(schema, patterns=None):
+    """selects the columns to extract from a schema
+
+    Args:
+        schema (list): output of read_schema
+        patterns (list, optional): regex patterns. A column is kept if any pattern
+            matches part of its name. Defaults to None, which keeps every column.
+
+    Raises:
+        ValueError: if any pattern matches 0 columns in the schema
+
+    Returns:
+        Plan: column names and slices of the selected columns, in schema order
+    """
+    if patterns is None:
+        selected = schema
+    else:
+        for pat in patterns:
+            if not any(re.search(pat, column) for column, _, _ in schema):
+                raise ValueError(f"pattern '{pat}' matched 0 columns")
+
+        selected = [
+            field
+            for field in schema
+            if any(re.search(pat, field[0]) for pat in patterns)
+        ]
+
+    return Plan(
+        columns=[column for column, _, _ in selected],
+        slices=[slice(start, start + length) for _, start, length in selected],
+    )
+
+
+def iter_records(lines, plan):
+    """slices the planned columns out of each fixed-width record
+
+    Args:
+        lines (iterable): records as strings, e.g. an open text file
+        plan (Plan): output of build_plan
+
+    Yields:
+        list: stripped values of each planned column
+    """
+    getter = itemgetter(*plan.slices)
+
+    if len(plan.slices) == 1:
+        for line in lines:
+            yield [getter(line.rstrip("\r\n")).strip()]
+    else:
+        for line in lines:
+            yield [value.strip() for value in getter(line.rstrip("\r\n"))]
+
+
+def extract_file(filename, plan, writer, encoding="utf-8"):
+    """writes the planned columns of a fixed-width file to a csv writer
+
+    Args:
+        filename (str): path to fixed-width file
+        plan (Plan): output of build_plan
+        writer (csv.writer): writer to write rows to. The header is not written.
+        encoding (str, optional): encoding of file. Defaults to "utf-8".
+
+    Returns:
+        int: number of rows written
+    """
+    n_rows = 0
+    with open(filename, "r", encoding=encoding, newline="") as fwf_file:
+        for row in iter_records(fwf_file, plan):
+            writer.writerow(row)
+            n_rows += 1
+
+    return n_rows
+
+
+def read_year(filename, schema, encoding="utf-8"):
+    """reads the year of the first record in a fixed-width file
+
+    Args:
+        filename (str): path to fixed-width file
+        schema (list): output of read_schema. Must contain a column named 'year'
+        encoding (str, optional): encoding of file. Defaults to "utf-8".
+
+    Returns:
+        int | None: 4-digit year, or None if the file has no records with a year
+    """
+    plan = build_plan(schema, ["^year$"])
+    with open(filename, "r", encoding=encoding, newline="") as fwf_file:
+        for (year,) in iter_records(fwf_file, plan):
+            if year != "":
+                year = int(year)
+                # 2-digit years, data starts at 1965
+                return year + 1900 if year >= 65 else year + 2000
+
+    return None
+
+
+def sort_by_year(filenames, schema, encoding="utf-8"):
+    """sorts files by the year of their first record, then by name
+
+    Args:
+        filenames (list): paths to fixed-width files
+        schema (list): output of read_schema
+        encoding (str, optional): encoding of files. Defaults to "utf-8".
+
+    Returns:
+        list: sorted filenames
+    """
+    years = {filename: read_year(filename, schema, encoding) for filename in filenames}
+    # files without any records go last
+    return sorted(
+        filenames,
+        key=lambda filename: (years[filename] is None, years[filename] or 0, filename),
+    )
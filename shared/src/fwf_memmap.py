@@ -0,0 +1,139 @@
+"""
+contains functions for reading fixed-length records as memory-mapped numpy arrays,
+so single columns can be read from raw files without parsing every row
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+
+def record_dtype(schema, content_length):
+    """builds a numpy structured dtype with one bytes field per schema column
+
+    Args:
+        schema (list): output of fwf.read_schema
+        content_length (int): length of each record, not counting the line terminator
+
+    Returns:
+        numpy.dtype: structured dtype. Columns that start after the end of the
+            record are left out, and columns that run past it are cut short.
+    """
+    fields = [
+        (column, start, min(length, content_length - start))
+        for column, start, length in schema
+        if start < content_length
+    ]
+    return np.dtype(
+        {
+            "names": [column for column, _, _ in fields],
+            "formats": [f"S{length}" for _, _, length in fields],
+            "offsets": [start for _, start, _ in fields],
+            "itemsize": content_length,
+        }
+    )
+
+
+def memmap_records(filename, schema):
+    """memory-maps a file of fixed-length, newline-terminated records. The last
+    record may leave out its line terminator, as it can in files fwf.iter_records
+    reads
+
+    Args:
+        filename (str): path to fixed-width file
+        schema (list): output of fwf.read_schema
+
+    Raises:
+        ValueError: if the records in the file are not all the same length
+
+    Returns:
+        numpy.ndarray: read-only structured array with one row per record and one
+            field per schema column. Selecting a field returns a strided view of the
+            file, so nothing is read until values are used.
+    """
+    with open(filename, "rb") as fwf_file:
+        first_line = fwf_file.readline()
+
+    file_size = os.path.getsize(filename)
+    record_length = len(first_line)
+    content_length = len(first_line.rstrip(b"\r\n"))
+    terminator = first_line[content_length:]
+    dtype = record_dtype(schema, content_length)
+
+    if file_size == 0:
+        return np.empty(0, dtype=dtype)
+
+    if file_size % record_length == 0:
+        n_records = file_size // record_length
+        n_terminated = n_records
+    elif terminator and (file_size + len(terminator)) % record_length == 0:
+        n_records = (file_size + len(terminator)) // record_length
+        n_terminated = n_records - 1
+    else:
+        raise ValueError(
+            f"'{filename}' does not contain fixed-length records: file size "
+            f"{file_size} does not fit records of the first record's length "
+            f"{record_length}"
+        )
+
+    raw = np.memmap(filename, dtype=np.uint8, mode="r")
+
+    # every record's line terminator has to be where the first record's is, or the
+    # lengths vary and later records would be read from the wrong offsets
+    terminators = np.ndarray(
+        shape=(n_terminated, len(terminator)),
+        dtype=np.uint8,
+        buffer=raw,
+        offset=content_length,
+        strides=(record_length, 1),
+    )
+    misplaced = (terminators != np.frombuffer(terminator, dtype=np.uint8)).any(axis=1)
+    if misplaced.any():
+        raise ValueError(
+            f"'{filename}' does not contain fixed-length records: record "
+            f"{misplaced.argmax() + 1} is not {content_length} characters long"
+        )
+
+    return np.ndarray(
+        shape=(n_records,), dtype=dtype, buffer=raw, strides=(record_length,)
+    )
+
+
+def decode_column(values, encoding="ascii"):
+    """decodes a bytes field to stripped strings
+
+    Args:
+        values (numpy.ndarray): field of a structured array from memmap_records
+        encoding (str, optional): encoding of file. Defaults to "ascii".
+
+    Returns:
+        numpy.ndarray: object array of strings, with NaN for empty values
+    """
+    values = np.char.decode(np.char.strip(values), encoding).astype(object)
+    values[values == ""] = np.NaN
+    return values
+
+
+def read_frame(records, columns, start=None, stop=None, encoding="ascii"):
+    """decodes some columns from a range of records into a dataframe
+
+    Args:
+        records (numpy.ndarray): output of memmap_records
+        columns (list): names of columns to decode
+        start (int, optional): first record to decode. Defaults to None.
+        stop (int, optional): record to stop decoding at. Defaults to None.
+        encoding (str, optional): encoding of file. Defaults to "ascii".
+
+    Returns:
+        pandas.DataFrame: dataframe with the same values in2csv would have written
+            for these records, as strings
+    """
+    block = records[start:stop]
+    return pd.DataFrame(
+        {
+            column: decode_column(block[column], encoding)
+            if column in block.dtype.names
+            else np.full(len(block), np.NaN, dtype=object)
+            for column in columns
+        }
+    )
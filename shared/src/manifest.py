@@ -0,0 +1,147 @@
+"""
+contains functions for caching per-file outputs keyed by a hash of each input file's
+content, so that reruns only redo the work for new or changed files. The cache is a
+directory of fragments plus a manifest.json recording the hash of every input file
+"""
+
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = "manifest.json"
+
+# number of bytes read at a time when hashing files
+HASH_BLOCKSIZE = 1 << 20
+
+# number of hex digits of an input file's hash that fragment names start with
+FRAGMENT_HASH_LENGTH = 20
+
+
+def file_hash(filename):
+    """computes the sha256 hash of a file's content
+
+    Args:
+        filename (str): path to file
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as in_file:
+        for block in iter(lambda: in_file.read(HASH_BLOCKSIZE), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def options_key(*options):
+    """hashes the options a fragment was made with, e.g. the columns extracted
+
+    Args:
+        *options: values whose repr identifies how fragments are made
+
+    Returns:
+        str: short hex digest to include in fragment names
+    """
+    return hashlib.sha256(repr(options).encode("utf-8")).hexdigest()[:12]
+
+
+def read_manifest(cache_dir):
+    """reads the manifest of a cache directory
+
+    Args:
+        cache_dir (str): path to cache directory
+
+    Returns:
+        dict: manifest entries by input filename, empty if there is no manifest
+    """
+    try:
+        with open(
+            f"{cache_dir}/{MANIFEST_FILENAME}", "r", encoding="utf-8"
+        ) as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_manifest(cache_dir, manifest):
+    """writes the manifest of a cache directory, replacing any previous one
+
+    Args:
+        cache_dir (str): path to cache directory
+        manifest (dict): manifest entries by input filename
+    """
+    temp_filename = f"{cache_dir}/{MANIFEST_FILENAME}.tmp"
+    with open(temp_filename, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    os.replace(temp_filename, f"{cache_dir}/{MANIFEST_FILENAME}")
+
+
+def hash_files(filenames, manifest):
+    """
+    hashes the content of files. Files whose size and modification time match their
+    manifest entry are not read again
+
+    Args:
+        filenames (list): paths to input files
+        manifest (dict): output of read_manifest
+
+    Returns:
+        dict: manifest entries by filename, with 'size', 'mtime_ns' and 'sha256' keys
+    """
+    entries = {}
+    for filename in filenames:
+        stat = os.stat(filename)
+        entry = manifest.get(filename, {})
+        if entry.get("size") != stat.st_size or entry.get("mtime_ns") != (
+            stat.st_mtime_ns
+        ):
+            entry = {"sha256": file_hash(filename)}
+
+        entries[filename] = {
+            **entry,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    return entries
+
+
+def fragment_path(cache_dir, entry, key, extension):
+    """builds the path of the cached fragment for an input file
+
+    Args:
+        cache_dir (str): path to cache directory
+        entry (dict): manifest entry of input file, from hash_files
+        key (str): output of options_key
+        extension (str): file extension of fragment
+
+    Returns:
+        str: path to fragment
+    """
+    return f"{cache_dir}/{entry['sha256'][:FRAGMENT_HASH_LENGTH]}-{key}.{extension}"
+
+
+def is_cached(entry, fragment):
+    """checks whether a complete fragment exists for a manifest entry"""
+    return "n_rows" in entry and os.path.exists(fragment)
+
+
+def prune_cache(cache_dir, manifest):
+    """
+    deletes fragments of input files that are no longer in the manifest, and partial
+    fragments left by interrupted runs. Fragments of current input files made with
+    other options or formats are kept, so switching back to them doesn't extract
+    everything again
+
+    Args:
+        cache_dir (str): path to cache directory
+        manifest (dict): manifest entries by input filename, from hash_files
+    """
+    hashes = {entry["sha256"][:FRAGMENT_HASH_LENGTH] for entry in manifest.values()}
+    for filename in os.listdir(cache_dir):
+        if filename == MANIFEST_FILENAME:
+            continue
+        if filename.endswith(".tmp") or filename.split("-")[0] not in hashes:
+            os.remove(f"{cache_dir}/{filename}")
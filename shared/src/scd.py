@@ -0,0 +1,119 @@
+"""
+contains functions for compressing a table with one row per key per year into a
+slowly changing dimension, with one row per key per run of years with the same
+attributes, and a lookup that finds the row that's valid for a key in a year
+"""
+
+import numpy as np
+import pandas as pd
+
+# names of the columns with the first and last years a dimension row is valid for
+VALID_FROM = "valid_from"
+VALID_TO = "valid_to"
+
+
+def same_as_previous(df):
+    """checks whether each row of df has the same values as the row before it
+
+    Args:
+        df (pandas.DataFrame): dataframe to check
+
+    Returns:
+        numpy.ndarray: boolean array, True where every value equals the one in the
+            row before, counting missing values as equal
+    """
+    previous = df.shift()
+    return ((df == previous) | (df.isna() & previous.isna())).all(axis=1).to_numpy()
+
+
+def build_dimension(df, key, year_col):
+    """
+    compresses df to one row per key per run of consecutive years with unchanged
+    values in every other column
+
+    Args:
+        df (pandas.DataFrame): dataframe with one row per key per year
+        key (str): name of column that identifies each entity, e.g. ori
+        year_col (str): name of year column
+
+    Returns:
+        pandas.DataFrame: dataframe with key, VALID_FROM and VALID_TO, the first and
+            last years of each run, and the other columns of df
+    """
+    attribute_cols = [col for col in df.columns if col not in [key, year_col]]
+    df = df.sort_values([key, year_col], ignore_index=True)
+
+    # a row continues the run before it if it's the next year of the same key, with
+    # the same attributes
+    keys = df[key].to_numpy()
+    years = df[year_col].to_numpy()
+    continues = same_as_previous(df[attribute_cols])
+    continues[1:] &= (keys[1:] == keys[:-1]) & (years[1:] == years[:-1] + 1)
+    continues[0] = False
+
+    runs = np.cumsum(~continues)
+    dimension = df.loc[~continues, [key] + attribute_cols].reset_index(drop=True)
+    dimension.insert(1, VALID_FROM, years[~continues])
+    dimension.insert(2, VALID_TO, pd.Series(years).groupby(runs).last().to_numpy())
+    return dimension
+
+
+class IntervalLookup:
+    """
+    finds the dimension row that's valid for each of many pairs of keys and years at
+    once, with a binary search over the rows sorted by key and VALID_FROM
+    """
+
+    def __init__(self, dimension, key):
+        """
+        Args:
+            dimension (pandas.DataFrame): output of build_dimension
+            key (str): name of column that identifies each entity, e.g. ori
+        """
+        self.dimension = dimension.sort_values([key, VALID_FROM], ignore_index=True)
+        self.keys = pd.Index(self.dimension[key].unique())
+        self.codes = self.keys.get_indexer(self.dimension[key])
+        self.first_year = self.dimension[VALID_FROM].min()
+        # years are offset within each key, so rows sort by key and then by year
+        self.span = self.dimension[VALID_TO].max() - self.first_year + 1
+        self.starts = self.codes * self.span + (
+            self.dimension[VALID_FROM].to_numpy() - self.first_year
+        )
+
+    def positions(self, keys, years):
+        """finds the dimension row that's valid for each key in each year
+
+        Args:
+            keys (array-like): keys to look up
+            years (array-like): year to look up each key in
+
+        Returns:
+            numpy.ndarray: position of each matching row in self.dimension, -1 where
+                the key has no row for that year
+        """
+        codes = self.keys.get_indexer(keys)
+        years = np.asarray(years)
+        targets = codes * self.span + (years - self.first_year)
+        found = np.searchsorted(self.starts, targets, side="right") - 1
+
+        valid = (codes >= 0) & (found >= 0)
+        found = np.where(valid, found, 0)
+        valid &= (self.codes[found] == codes) & (
+            years <= self.dimension[VALID_TO].to_numpy()[found]
+        )
+        return np.where(valid, found, -1)
+
+    def lookup(self, keys, years):
+        """gets the dimension row that's valid for each key in each year
+
+        Args:
+            keys (array-like): keys to look up
+            years (array-like): year to look up each key in
+
+        Returns:
+            pandas.DataFrame: one row per key, with missing values where the key has
+                no row for that year
+        """
+        found = self.positions(keys, years)
+        rows = self.dimension.reindex(np.where(found >= 0, found, len(self.dimension)))
+        return rows.reset_index(drop=True)
@@ -0,0 +1,46 @@
+"""
+compresses transformed agency data, with one row per agency per year, to one row per
+agency per run of years in which its name, state, county and msa don't change
+"""
+
+import logging
+import sys
+import pandas as pd
+from scd import build_dimension, IntervalLookup
+
+logging.basicConfig(filename="output/dimension.log", filemode="w", level=logging.INFO)
+
+# columns that change almost every year, which would split nearly every run. They're
+# left out of the dimension and stay in the per-year agency data
+YEARLY_COLS = ["population"]
+
+
+def check_dimension(df, dimension):
+    """
+    checks that looking up each agency and year of df in dimension gives back the
+    same row
+
+    Args:
+        df (pandas.DataFrame): transformed agency data, without unique_id
+        dimension (pandas.DataFrame): output of build_dimension
+
+    Raises:
+        AssertionError: if any agency and year gets a different row
+    """
+    found = IntervalLookup(dimension, "ori").lookup(df.ori, df.data_year)
+    expected = df.drop(columns="data_year").reset_index(drop=True)
+    pd.testing.assert_frame_equal(found[expected.columns], expected)
+
+
+if __name__ == "__main__":
+    df = pd.read_csv(sys.argv[1], low_memory=False).drop(
+        columns=["unique_id"] + YEARLY_COLS
+    )
+    dimension = build_dimension(df, "ori", "data_year")
+    check_dimension(df, dimension)
+    dimension.to_csv(sys.argv[2], index=False, line_terminator="\n")
+    logging.info(
+        "compressed %s agency years to %s rows.",
+        len(df),
+        len(dimension),
+    )
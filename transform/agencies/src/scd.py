@@ -0,0 +1 @@
+../../../shared/src/scd.py
\ No newline at end of file
@@ -5,6 +5,7 @@ import sys
 import pandas as pd
 from standardize import standardize_ori
 from assign_unique_ids import assign_unique_ids
+from columnar import write_table
 
 logging.basicConfig(filename="output/transform.log", filemode="w", level=logging.INFO)
 
@@ -20,7 +21,11 @@ def do_transform(dataframe):
 if __name__ == "__main__":
     df = pd.read_csv(sys.argv[1], low_memory=False)
     df = do_transform(df)
-    print(df.to_csv(index=False, line_terminator="\n"))
+    if len(sys.argv) > 2:
+        # write to a file instead of stdout, e.g. a parquet dataset
+        write_table(df, sys.argv[2], partition_col="data_year")
+    else:
+        print(df.to_csv(index=False, line_terminator="\n"))
     logging.info(
         "wrote %s lines and %s columns to file.",
         len(df),
@@ -0,0 +1 @@
+../../../shared/src/chunking.py
\ No newline at end of file
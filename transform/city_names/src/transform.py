@@ -1,40 +1,104 @@
 """extracts unique ORIs and city names from reta data"""
 
+import math
 import sys
 import pandas as pd
 from tqdm import tqdm
 from standardize import standardize_ori
-from utils import guess_n_loops
+from chunking import (
+    SAMPLE_ROWS,
+    bytes_per_row,
+    memory_budget,
+    pick_chunksize,
+    track_progress,
+)
+from columnar import count_rows, is_parquet, iter_tables
 
-CHUNKSIZE = 10000
+# megabytes of memory each chunk may use, unless MEMORY_BUDGET_MB is set
+MEMORY_BUDGET_MB = 64
 ENCODING = "latin1"
 SELECT_COLUMNS = ["ori_code", "mailing_addr_line4"]
 COLNAME = "city_name"
 
-chunks = pd.read_csv(
-    sys.argv[1],
-    chunksize=CHUNKSIZE,
-    encoding=ENCODING,
-    low_memory=False,
-)
 
-dfs = []
-
-for i, chunk in tqdm(
-    enumerate(chunks),
-    total=guess_n_loops(sys.argv[1], chunksize=CHUNKSIZE, encoding=ENCODING),
-):
-    chunk = chunk[SELECT_COLUMNS].copy()
-    chunk[COLNAME] = chunk.mailing_addr_line4.str.extract(rf"^(?P<{COLNAME}>.*)(?=,)")[
-        COLNAME
-    ]
-    del chunk["mailing_addr_line4"]
-    chunk = chunk.dropna(subset=COLNAME)
-    chunk["ori_code"] = chunk.ori_code.apply(standardize_ori)
-    dfs.append(chunk)
-
-print(
-    pd.concat(dfs)
-    .drop_duplicates(subset="ori_code", keep="first")
-    .to_csv(index=False, line_terminator="\n")
-)
+def iter_chunks(path):
+    """
+    reads the input in chunks sized to fit in the memory budget, with a progress bar.
+    csv files are tracked by byte offset, so they're not read an extra time to count
+    their lines
+
+    Args:
+        path (str): path to csv file or parquet dataset
+
+    Yields:
+        pandas.DataFrame: chunks of rows
+    """
+    budget = memory_budget(MEMORY_BUDGET_MB)
+
+    if is_parquet(path):
+        sample = next(iter_tables(path, SAMPLE_ROWS, columns=SELECT_COLUMNS), None)
+        chunksize = pick_chunksize(bytes_per_row(sample), budget)
+        yield from tqdm(
+            iter_tables(path, chunksize, columns=SELECT_COLUMNS),
+            total=math.ceil(count_rows(path) / chunksize),
+        )
+        return
+
+    sample = pd.read_csv(
+        path, nrows=SAMPLE_ROWS, usecols=SELECT_COLUMNS, encoding=ENCODING, dtype=str
+    )
+    chunksize = pick_chunksize(bytes_per_row(sample), budget)
+    with open(path, "rb") as in_file:
+        yield from track_progress(
+            pd.read_csv(
+                in_file,
+                chunksize=chunksize,
+                usecols=SELECT_COLUMNS,
+                encoding=ENCODING,
+                dtype=str,
+            ),
+            in_file,
+            "read file",
+        )
+
+
+def find_new_cities(chunk, cities):
+    """
+    finds the city name of each ORI in chunk that isn't in cities yet, and adds them
+    to cities
+
+    Args:
+        chunk (pandas.DataFrame): chunk of rows with SELECT_COLUMNS
+        cities (dict): city name of each ORI seen so far, by ORI
+
+    Returns:
+        pandas.DataFrame: first row of each new ORI, with ori_code and COLNAME
+    """
+    chunk = pd.DataFrame(
+        {
+            "ori_code": chunk.ori_code,
+            COLNAME: chunk.mailing_addr_line4.str.extract(rf"^(?P<{COLNAME}>.*)(?=,)")[
+                COLNAME
+            ],
+        }
+    ).dropna(subset=COLNAME)
+    chunk["ori_code"] = chunk.ori_code.map(
+        {ori: standardize_ori(ori) for ori in chunk.ori_code.unique()}
+    )
+    chunk = chunk.drop_duplicates(subset="ori_code", keep="first")
+    chunk = chunk[~chunk.ori_code.isin(cities)]
+    cities.update(zip(chunk.ori_code, chunk[COLNAME]))
+    return chunk
+
+
+if __name__ == "__main__":
+    cities = {}
+    # write each ORI as soon as it's first seen, so memory stays proportional to the
+    # number of agencies instead of the number of rows
+    pd.DataFrame(columns=["ori_code", COLNAME]).to_csv(
+        sys.stdout, index=False, line_terminator="\n"
+    )
+    for chunk in iter_chunks(sys.argv[1]):
+        find_new_cities(chunk, cities).to_csv(
+            sys.stdout, index=False, header=False, line_terminator="\n"
+        )
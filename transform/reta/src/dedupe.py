@@ -0,0 +1 @@
+../../../shared/src/dedupe.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../shared/src/fwf_memmap.py
\ No newline at end of file
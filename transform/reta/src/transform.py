@@ -2,15 +2,34 @@
 transforms the output of in2csv's parsing of the fixed-width files to more usable formats
 """
 
+import argparse
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
 import logging
+from logging.handlers import BufferingHandler
+import math
+import multiprocessing
+import os
 import re
-import sys
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from tqdm import tqdm
-from utils import guess_n_loops, replace_vals_from_yaml
+from utils import read_replacements, replace_vals_from_yaml
 from standardize import standardize_ori
 from assign_unique_ids import assign_unique_ids
+from chunking import (
+    SAMPLE_ROWS,
+    bytes_per_row,
+    memory_budget,
+    pick_chunksize,
+    track_progress,
+)
+from dedupe import SeenKeys, hash_values
+from columnar import count_rows, is_parquet, iter_tables, write_table
+from fwf import build_plan, read_schema, sort_by_year
+from fwf_memmap import memmap_records, read_frame
 
 logging.basicConfig(filename="output/transform.log", filemode="w", level=logging.INFO)
 
@@ -34,18 +53,109 @@ INDEX_COLS = [
 
 KEEP_COLS_PATS = [TOTAL_COLS_PAT] + INDEX_COLS + OTHER_COLS_PATS
 
+# months in calendar order, as they're abbreviated in the names of the total columns
+MONTHS = [
+    "jan",
+    "feb",
+    "mar",
+    "apr",
+    "may",
+    "jun",
+    "jul",
+    "aug",
+    "sep",
+    "oct",
+    "nov",
+    "dec",
+]
+
+# regex pattern to split the name of a total column into the columns of the output
+VARIABLE_PAT = (
+    rf"^(?P<month>{'|'.join(MONTHS)})_"
+    r"(?P<card>actual|cleared_arrest)_(?P<category>[a-z\d_]*?$)"
+)
+
+# columns that values are summed by in the totals written with --totals, the same
+# ones the notebooks group data_reta by
+TOTALS_COLS = ["ori_code", "card", "year"]
+
+# megabytes of memory each chunk may use, unless MEMORY_BUDGET_MB is set
+MEMORY_BUDGET_MB = 256
+
+ENCODING = "latin1"
+
+# arguments for reading the output of extract/reta
+CSV_KWARGS = {
+    "encoding": ENCODING,
+    "low_memory": False,
+    "dtype": {
+        # it's a 2-digit code representing the last 2 digits of the year
+        "year": str,
+    },
+}
+
+# schema of the raw files, used when reading them directly
+SCHEMA_FILENAME = "input/fwf-schema.csv"
+
 DTYPES = {
     "ori_code": str,
     "agency_name": str,
     "core_city": bool,
     "agency_state_name": str,
     "year": int,
-    "month": str,
-    "card": str,
-    "category": str,
+    "month": "category",
+    "card": "category",
+    "category": "category",
     "value": int,
 }
 
+# dtypes used with --compact. Strings that repeat on every row are categories, which
+# store each distinct value once, and integers use the smallest widths that fit them
+COMPACT_DTYPES = {
+    "ori_code": "category",
+    "agency_name": "category",
+    "core_city": bool,
+    "agency_state_name": "category",
+    "year": "int16",
+    "month": "category",
+    "card": "category",
+    "category": "category",
+    "value": "int32",
+}
+
+# schema of the output when it's written as a parquet dataset
+ARROW_SCHEMA = pa.schema(
+    [
+        ("unique_id", pa.string()),
+        ("ori_code", pa.string()),
+        ("agency_name", pa.string()),
+        ("core_city", pa.bool_()),
+        ("agency_state_name", pa.string()),
+        ("year", pa.int64()),
+        ("month", pa.string()),
+        ("card", pa.string()),
+        ("category", pa.string()),
+        ("value", pa.int64()),
+    ]
+)
+
+# schema of the parquet dataset written with --compact. Categories are dictionary
+# encoded, so readers get them back as categories
+COMPACT_ARROW_SCHEMA = pa.schema(
+    [
+        ("unique_id", pa.string()),
+        ("ori_code", pa.dictionary(pa.int32(), pa.string())),
+        ("agency_name", pa.dictionary(pa.int32(), pa.string())),
+        ("core_city", pa.bool_()),
+        ("agency_state_name", pa.dictionary(pa.int32(), pa.string())),
+        ("year", pa.int16()),
+        ("month", pa.dictionary(pa.int32(), pa.string())),
+        ("card", pa.dictionary(pa.int32(), pa.string())),
+        ("category", pa.dictionary(pa.int32(), pa.string())),
+        ("value", pa.int32()),
+    ]
+)
+
 # list of dictionaries mapping column names to values for rows I want dropped
 DROP_ROWS = [
     {
@@ -89,73 +199,147 @@ def select_columns(df):
     return keep_cols
 
 
-def melt_df(df, cols):
-    """turns specified cols in df to rows
+@functools.lru_cache(maxsize=None)
+def parse_value_columns(cols):
+    """
+    parses the month, card and category out of the names of the total columns. The
+    column names are the same for every chunk, so this only runs once
 
     Args:
-        df (pandas.DataFrame): dataframe to melt
-        cols (list): list of column names
+        cols (tuple): column names, e.g. KEEP_COLS
 
     Returns:
-        pandas.DataFrame: melted dataframe
+        tuple: list of names of the total columns, and a dictionary of categoricals
+            with the month, card and category of each of them
     """
-    return df.melt(
-        id_vars=INDEX_COLS,
-        value_vars=[col for col in cols if re.search(TOTAL_COLS_PAT, col) is not None],
-    )
+    value_cols = [col for col in cols if re.search(TOTAL_COLS_PAT, col) is not None]
+    matches = [re.search(VARIABLE_PAT, col) for col in value_cols]
+    labels = {
+        group: pd.Categorical(
+            [np.NaN if match is None else match.group(group) for match in matches]
+        )
+        for group in re.compile(VARIABLE_PAT).groupindex
+    }
+    return value_cols, labels
 
 
-def split_variable(df):
-    """splits the 'variable' column into multiple columns based on regex
+def tile_categorical(values, reps):
+    """
+    repeats values reps times as a categorical, so each distinct value is stored once
+    instead of once per row
 
     Args:
-        df (pandas.DataFrame): dataframe containing a column named 'variable'
+        values (pandas.Series): values to repeat
+        reps (int): number of times to repeat them
 
     Returns:
-        pandas.DataFrame: dataframe with variable column split into multiple columns
+        pandas.Categorical: values, repeated
+    """
+    codes, categories = pd.factorize(values)
+    return pd.Categorical.from_codes(np.tile(codes, reps), categories)
+
+
+def reshape_long(df, cols, categorical_cols=()):
     """
-    # get a dataframe with matches of regex
-    extract_df = df.variable.str.extract(
-        r"^(?P<month>jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)_"
-        r"(?P<card>actual|cleared_arrest)_(?P<category>[a-z\d_]*?$)"
+    turns the total columns in df to rows, with the month, card and category of each
+    total as categorical columns. Rows are in the same order as melting the total
+    columns, i.e. every row of the first total column, then of the second...
+
+    Args:
+        df (pandas.DataFrame): dataframe to reshape
+        cols (list): list of column names
+        categorical_cols (tuple, optional): index columns to convert to strings and
+            store as categoricals. Defaults to (), which repeats every index column
+            as it is.
+
+    Returns:
+        pandas.DataFrame: dataframe with INDEX_COLS, month, card, category and value
+    """
+    value_cols, labels = parse_value_columns(tuple(cols))
+    n_rows = len(df)
+
+    long_df = pd.DataFrame(
+        {
+            col: tile_categorical(df[col].astype(str), len(value_cols))
+            if col in categorical_cols
+            else np.tile(df[col].to_numpy(), len(value_cols))
+            for col in INDEX_COLS
+        }
     )
-    # store group names for later
-    group_names = extract_df.columns.tolist()
-    # join the dataframes
-    df = df.join(extract_df)
-    # conserve memory
-    del extract_df
-
-    # reorder columns
-    drop_cols = ["variable"]
-    df = df[[col for col in df.columns if col not in drop_cols]]
-    df = df.set_index(INDEX_COLS + group_names).reset_index()
+    for group, categorical in labels.items():
+        long_df[group] = pd.Categorical.from_codes(
+            np.repeat(categorical.codes, n_rows), categorical.categories
+        )
+    # column-major order stacks each total column under the previous one
+    long_df["value"] = df[value_cols].to_numpy().ravel(order="F")
 
-    return df
+    return long_df
 
 
-def drop_unrecognized_negative_value_entries(df):
+def decode_values(values, overpunch_vals):
     """
-    drops any remaining non-numeric values after attempting conversion.
-    some values contain negative entries that are not documented, so they must be dropped.
+    converts raw values to numbers in one pass. Plain numbers are parsed, overpunched
+    negative values are looked up in overpunch_vals, and anything else is NaN.
+    some values contain negative entries that are not documented, so they must be
+    dropped.
 
     Args:
-        df (pandas.DataFrame): dataframe to drop from
+        values (pandas.Series): raw values
+        overpunch_vals (dict): overpunch codes and the numbers they stand for, i.e.
+            the contents of hand/value.yaml
 
     Returns:
-        pandas.DataFrame: dataframe with entries dropped
+        pandas.Series: numeric values, with NaN for values that couldn't be decoded
     """
+    decoded = pd.to_numeric(values, errors="coerce")
+    # only the few values that aren't plain numbers are looked up
+    not_numeric = decoded.isna() & values.notna()
+    decoded[not_numeric] = values[not_numeric].map(overpunch_vals)
 
-    def try_convert(val):
-        try:
-            float(val)
-        except ValueError:
-            return np.NaN
-        else:
-            return val
+    n_undecodable = decoded[not_numeric].isna().sum()
+    if n_undecodable > 0:
+        logging.info("dropped %s values that couldn't be decoded", n_undecodable)
+    return decoded
 
-    df["value"] = df.value.apply(try_convert)
-    return df
+
+@functools.lru_cache(maxsize=None)
+def read_replacements_once(yaml_filename):
+    """reads a yaml file of replacements, only once for all chunks"""
+    return read_replacements(yaml_filename)
+
+
+def coerce_dtypes(df, dtypes):
+    """coerces the dtypes of df, checking that integers fit in the widths in dtypes
+
+    Args:
+        df (pandas.DataFrame): dataframe to coerce
+        dtypes (dict): column names and dtypes, e.g. DTYPES or COMPACT_DTYPES
+
+    Raises:
+        ValueError: if a column has values that don't fit in its integer dtype
+
+    Returns:
+        pandas.DataFrame: dataframe with dtypes coerced
+    """
+    for col, dtype in dtypes.items():
+        if not pd.api.types.is_integer_dtype(dtype):
+            continue
+
+        values = df[col].astype(np.int64)
+        bounds = np.iinfo(dtype)
+        if len(values) > 0 and (values.min() < bounds.min or values.max() > bounds.max):
+            raise ValueError(
+                f"values of '{col}' range from {values.min()} to {values.max()}, "
+                f"which doesn't fit in {dtype}"
+            )
+        df[col] = values
+
+    return df.astype(dtypes)
+
+
+def categorical_cols(dtypes):
+    """lists the index columns that are categories in dtypes"""
+    return tuple(col for col in INDEX_COLS if dtypes[col] == "category")
 
 
 def drop_blank_rows(df):
@@ -182,10 +366,44 @@ def drop_duplicate_rows(df):
     new_len = len(df)
     n_dropped = orig_len - new_len
     if n_dropped > 0:
-        logging.info("dropped %s rows with missing index values", orig_len - new_len)
+        logging.info("dropped %s exact duplicate rows", n_dropped)
     return df
 
 
+def drop_written_rows(df, seen):
+    """
+    drops rows whose unique_id was already written in an earlier chunk, so duplicates
+    are dropped the same way however the file is split into chunks. Rows that repeat
+    a unique_id with different values are an error, like they are within a chunk
+
+    Args:
+        df (pandas.DataFrame): transformed dataframe with unique ids
+        seen (SeenKeys): hashes of the unique ids written so far. The ids in df that
+            weren't written yet are added to it
+
+    Raises:
+        ValueError: if a unique_id was written with different values
+
+    Returns:
+        pandas.DataFrame: dataframe without the rows that were already written
+    """
+    keys = hash_values(df.unique_id)
+    rows = hash_values(df.drop(columns="unique_id"))
+    written, changed = seen.lookup(keys, rows)
+
+    if changed.any():
+        df[changed].to_csv("output/dupe_rows.csv", index=False)
+        raise ValueError(
+            f"{changed.sum()} unique IDs were already written with different values.\n\n"
+            "dumped the rows with those IDs to output/dupe_rows.csv for inspection"
+        )
+
+    seen.add(keys[~written], rows[~written])
+    if written.any():
+        logging.info("dropped %s rows written in earlier chunks", written.sum())
+    return df[~written]
+
+
 def manual_drop_rows(df):
     """Drops rows described in DROP_ROWS"""
 
@@ -195,38 +413,50 @@ def manual_drop_rows(df):
     return df
 
 
-def do_transformation(df):
+def do_transformation(df, keep_cols, yaml_filenames, compact=False):
     """does all necessary transformations on the data
 
     Args:
         df (pandas.DataFrame): original dataframe from the output of extract/
+        keep_cols (list): columns to keep, from select_columns
+        yaml_filenames (list): paths to yaml files in hand/ with values to replace
+        compact (bool, optional): use COMPACT_DTYPES instead of DTYPES. Defaults to
+            False.
 
     Returns:
         pandas.DataFrame: transformed dataframe
     """
+    dtypes = COMPACT_DTYPES if compact else DTYPES
     # drop rows missing all index data (there are a few)
     df = drop_blank_rows(df)
     # drop the columns you don't want
-    df = df[KEEP_COLS]
-    # melt the dataframe
-    df = melt_df(df, KEEP_COLS)
+    df = df[keep_cols]
+    # turn the total columns to rows
+    df = reshape_long(df, keep_cols, categorical_cols(dtypes))
     # replace values from yaml files in hand/
-    for filename in sys.argv[2:-1]:
+    overpunch_vals = {}
+    for filename in yaml_filenames:
         assert filename.endswith(".yaml") or filename.endswith(".yml"), (
             "all other arguments besides input file must be yaml files, except for "
             "last argument, which should be output file"
         )
-        df = replace_vals_from_yaml(df, filename)
-    # drop any negative value entries that weren't replaced
-    df = drop_unrecognized_negative_value_entries(df)
-    # split the 'variable' column and reorder columns
-    df = split_variable(df)
+        colname, replace_vals = read_replacements_once(filename)
+        if colname == "value":
+            # values are replaced while decoding them
+            overpunch_vals = replace_vals
+        else:
+            df = replace_vals_from_yaml(df, filename)
+    # decode values and drop any negative value entries that aren't in value.yaml
+    df["value"] = decode_values(df.value, overpunch_vals)
     # fill all NaN values with 0
     df["value"] = df.value.fillna(0)
     # coerce dtypes
-    df = df.astype(DTYPES)
-    # standardization
+    df = coerce_dtypes(df, dtypes)
+    # standardization. For categories only the distinct values are standardized
     df["ori_code"] = df.ori_code.apply(standardize_ori)
+    if compact:
+        # standardizing can merge categories, which turns them back to strings
+        df["ori_code"] = df.ori_code.astype("category")
     # drop duplicates on all rows
     df = drop_duplicate_rows(df)
     # assign unique IDs
@@ -243,47 +473,365 @@ def do_transformation(df):
     return df
 
 
-if __name__ == "__main__":
-    CHUNKSIZE = 1000  # using a small chunksize as the resulting files are 600x taller
-    ENCODING = "latin1"
-
-    total_loops = guess_n_loops(sys.argv[1], CHUNKSIZE, ENCODING)
-
-    chunks = pd.read_csv(
-        sys.argv[1],
-        chunksize=CHUNKSIZE,
-        encoding=ENCODING,
-        low_memory=False,
-        dtype={
-            "year": str,  # it's a 2-digit code representing the last 2 digits of the year
-        },
+def read_fwf_chunks(dirname, schema_filename, chunksize, encoding="latin1"):
+    """
+    reads chunks of the raw fixed-width files in dirname through memory maps, instead
+    of reading the csv output of extract/. Only the columns matched by KEEP_COLS_PATS
+    are decoded, and files are read in year order like in extract/, so the chunks
+    are the same as when reading the csv.
+
+    Args:
+        dirname (str): directory containing raw fixed-width files
+        schema_filename (str): path to fwf-schema.csv
+        chunksize (int): number of records per chunk
+        encoding (str, optional): encoding of files. Defaults to "latin1".
+
+    Returns:
+        tuple: generator of dataframes and the total number of chunks
+    """
+    schema = read_schema(schema_filename)
+    columns = build_plan(schema, KEEP_COLS_PATS).columns
+    filenames = sort_by_year(
+        [os.path.join(dirname, filename) for filename in os.listdir(dirname)],
+        schema,
+        encoding,
     )
+    all_records = [memmap_records(filename, schema) for filename in filenames]
+
+    def chunks():
+        # chunks span file boundaries, so they hold the same rows as the csv chunks
+        frames = []
+        n_rows = 0
+        for records in all_records:
+            start = 0
+            while start < len(records):
+                stop = start + chunksize - n_rows
+                frames.append(read_frame(records, columns, start, stop, encoding))
+                n_rows += len(frames[-1])
+                start = stop
+                if n_rows == chunksize:
+                    yield pd.concat(frames, ignore_index=True)
+                    frames = []
+                    n_rows = 0
+        if n_rows > 0:
+            yield pd.concat(frames, ignore_index=True)
+
+    total_rows = sum(len(records) for records in all_records)
+    return chunks(), math.ceil(total_rows / chunksize)
+
+
+def sum_values(chunk):
+    """
+    sums value by TOTALS_COLS in a transformed chunk. Categories are converted to
+    strings, so sums from chunks with different categories can be combined
 
-    KEEP_COLS = None
-    for loop_index, chunk in tqdm(
-        enumerate(chunks),
-        desc="transform file",
-        total=total_loops,
-        leave=False,
-    ):
-        if KEEP_COLS is None:
-            KEEP_COLS = select_columns(chunk)
-
-        chunk = do_transformation(chunk)
-
-        if loop_index == 0:
-            MODE = "w"
-            HEADER = True
-        else:
-            MODE = "a"
-            HEADER = False
+    Args:
+        chunk (pandas.DataFrame): transformed dataframe
+
+    Returns:
+        pandas.DataFrame: dataframe with TOTALS_COLS and value
+    """
+    sums = (
+        chunk.astype({"value": np.int64})
+        .groupby(TOTALS_COLS, observed=True, sort=False, dropna=False)
+        .value.sum()
+        .reset_index()
+    )
+    return sums.astype({col: object for col in sums.columns[sums.dtypes == "category"]})
 
-        chunk.to_csv(sys.argv[-1], index=False, mode=MODE, header=HEADER)
 
-        logging.info(
-            "[%s/%s] wrote %s lines and %s columns to file.",
-            loop_index + 1,
-            total_loops,
-            len(chunk),
-            len(chunk.columns),
+def combine_totals(partials):
+    """
+    combines partial sums into one row per value of TOTALS_COLS, sorted by them
+
+    Args:
+        partials (list): dataframes from sum_values or combine_totals
+
+    Returns:
+        pandas.DataFrame: dataframe with TOTALS_COLS and value
+    """
+    if len(partials) == 0:
+        return pd.DataFrame(columns=TOTALS_COLS + ["value"])
+
+    totals = (
+        pd.concat(partials, ignore_index=True)
+        .groupby(TOTALS_COLS, sort=False, dropna=False)
+        .value.sum()
+        .reset_index()
+    )
+    return totals.sort_values(TOTALS_COLS, ignore_index=True)
+
+
+def add_totals(partials, chunk):
+    """
+    adds the sums of a transformed chunk to partials, a list of partial sums, so the
+    totals are accumulated as chunks are written. The partial sums are combined
+    whenever they have more rows than the first one, which holds the sums combined so
+    far, so memory stays bounded by the size of the totals
+
+    Args:
+        partials (list): partial sums, modified in place
+        chunk (pandas.DataFrame): transformed dataframe
+    """
+    partials.append(sum_values(chunk))
+    if sum(len(partial) for partial in partials[1:]) > len(partials[0]):
+        partials[:] = [combine_totals(partials)]
+
+
+def transform_chunk(chunk, keep_cols, yaml_filenames, compact):
+    """
+    runs do_transformation in a worker process. Log records are collected and
+    returned instead of written, so they can be written in chunk order
+
+    Returns:
+        tuple: transformed dataframe and list of log records
+    """
+    handler = BufferingHandler(math.inf)
+    logging.getLogger().handlers = [handler]
+    return do_transformation(chunk, keep_cols, yaml_filenames, compact), handler.buffer
+
+
+def write_chunk(chunk, records, output, loop_index, schema, seen, totals=None):
+    """
+    writes a transformed chunk and the log records from transforming it, without the
+    rows written in earlier chunks
+
+    Args:
+        chunk (pandas.DataFrame): transformed dataframe
+        records (list): log records from transform_chunk
+        output (str): path to output csv or parquet dataset
+        loop_index (int): index of chunk
+        schema (pyarrow.Schema): ARROW_SCHEMA or COMPACT_ARROW_SCHEMA
+        seen (SeenKeys): hashes of the unique ids written in earlier chunks
+        totals (list, optional): partial sums to add the chunk's sums to with
+            add_totals. Defaults to None, which doesn't sum values.
+    """
+    for record in records:
+        logging.getLogger().handle(record)
+
+    chunk = drop_written_rows(chunk, seen)
+
+    write_table(
+        chunk,
+        output,
+        schema=schema,
+        part_number=loop_index,
+        append=loop_index > 0,
+    )
+
+    logging.info(
+        "[chunk %s] wrote %s lines and %s columns to file.",
+        loop_index + 1,
+        len(chunk),
+        len(chunk.columns),
+    )
+
+    if totals is not None:
+        add_totals(totals, chunk)
+
+
+def transform_serial(chunks, keep_cols, yaml_filenames, output, compact, totals):
+    """transforms and writes chunks one after another
+
+    Args:
+        chunks (iterable): dataframes to transform
+        keep_cols (list): columns to keep, from select_columns
+        yaml_filenames (list): paths to yaml files in hand/ with values to replace
+        output (str): path to output csv or parquet dataset
+        compact (bool): use COMPACT_DTYPES and COMPACT_ARROW_SCHEMA
+        totals (list | None): partial sums to add each chunk's sums to, or None
+    """
+    schema = COMPACT_ARROW_SCHEMA if compact else ARROW_SCHEMA
+    seen = SeenKeys()
+    for loop_index, chunk in enumerate(chunks):
+        chunk = do_transformation(chunk, keep_cols, yaml_filenames, compact)
+        write_chunk(chunk, [], output, loop_index, schema, seen, totals)
+
+
+def transform_parallel(
+    chunks, keep_cols, yaml_filenames, output, compact, totals, jobs
+):
+    """
+    transforms chunks on a pool of worker processes while a writer thread writes
+    them in chunk order, so reading, transforming and writing overlap. The output
+    and log are the same as transform_serial's. At most 2 chunks per worker are
+    held in memory at once.
+
+    Args:
+        chunks (iterable): dataframes to transform
+        keep_cols (list): columns to keep, from select_columns
+        yaml_filenames (list): paths to yaml files in hand/ with values to replace
+        output (str): path to output csv or parquet dataset
+        compact (bool): use COMPACT_DTYPES and COMPACT_ARROW_SCHEMA
+        totals (list | None): partial sums to add each chunk's sums to, or None
+        jobs (int): number of worker processes
+    """
+    schema = COMPACT_ARROW_SCHEMA if compact else ARROW_SCHEMA
+    # only the writer thread uses seen, so it needs no lock
+    seen = SeenKeys()
+    max_pending = 2 * jobs
+    transforming = collections.deque()
+    writing = collections.deque()
+
+    # workers are forked, so they don't import this module again and truncate the log
+    with ProcessPoolExecutor(
+        max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+    ) as pool, ThreadPoolExecutor(max_workers=1) as writer:
+
+        def write_next():
+            loop_index, future = transforming.popleft()
+            writing.append(
+                writer.submit(
+                    write_chunk,
+                    *future.result(),
+                    output,
+                    loop_index,
+                    schema,
+                    seen,
+                    totals,
+                )
+            )
+            while len(writing) > max_pending:
+                writing.popleft().result()
+
+        for loop_index, chunk in enumerate(chunks):
+            transforming.append(
+                (
+                    loop_index,
+                    pool.submit(
+                        transform_chunk, chunk, keep_cols, yaml_filenames, compact
+                    ),
+                )
+            )
+            if len(transforming) >= max_pending:
+                write_next()
+
+        while len(transforming) > 0:
+            write_next()
+        for future in writing:
+            future.result()
+
+
+def read_sample(path):
+    """reads the first rows of the input, to select columns and measure memory use
+
+    Args:
+        path (str): path to csv file, parquet dataset or directory of raw files
+
+    Returns:
+        pandas.DataFrame: first SAMPLE_ROWS rows
+    """
+    if is_parquet(path):
+        return next(iter_tables(path, SAMPLE_ROWS), pd.DataFrame())
+
+    if os.path.isdir(path):
+        chunks, _ = read_fwf_chunks(path, SCHEMA_FILENAME, SAMPLE_ROWS, ENCODING)
+        return next(chunks, pd.DataFrame())
+
+    return pd.read_csv(path, nrows=SAMPLE_ROWS, **CSV_KWARGS)
+
+
+def iter_chunks(path, keep_cols, chunksize):
+    """
+    reads the input in chunks with a progress bar. csv files are tracked by byte
+    offset, so they're not read an extra time to count their lines
+
+    Args:
+        path (str): path to csv file, parquet dataset or directory of raw files
+        keep_cols (list): columns to keep, from select_columns
+        chunksize (int): number of rows per chunk
+
+    Yields:
+        pandas.DataFrame: chunks of chunksize rows
+    """
+    if is_parquet(path):
+        # only read the columns that are needed
+        yield from tqdm(
+            iter_tables(path, chunksize, columns=keep_cols),
+            desc="transform file",
+            total=math.ceil(count_rows(path) / chunksize),
+            leave=False,
         )
+    elif os.path.isdir(path):
+        chunks, total_loops = read_fwf_chunks(
+            path, SCHEMA_FILENAME, chunksize, ENCODING
+        )
+        yield from tqdm(chunks, desc="transform file", total=total_loops, leave=False)
+    else:
+        with open(path, "rb") as in_file:
+            yield from track_progress(
+                pd.read_csv(in_file, chunksize=chunksize, **CSV_KWARGS),
+                in_file,
+                "transform file",
+            )
+
+
+def parse_args():
+    """parses command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "input",
+        help="path to output of extract/reta, or to a directory of raw files",
+    )
+    parser.add_argument(
+        "yaml_files", nargs="*", help="yaml files in hand/ with values to replace"
+    )
+    parser.add_argument("output", help="path to output csv or parquet dataset")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes. 1 transforms chunks serially, 0 uses all "
+        "cores",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="store repeated strings as categories and integers in the smallest "
+        "widths that fit them",
+    )
+    parser.add_argument(
+        "--totals",
+        help="path to also write the sums of value by ori_code, card and year to, as "
+        "csv or a parquet dataset",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    sample = read_sample(args.input)
+    KEEP_COLS = select_columns(sample)
+    # each chunk is in memory along with its reshaped copy, which is 600x taller
+    CATEGORICAL_COLS = categorical_cols(COMPACT_DTYPES if args.compact else DTYPES)
+    CHUNKSIZE = pick_chunksize(
+        bytes_per_row(
+            sample[KEEP_COLS],
+            reshape_long(sample[KEEP_COLS], KEEP_COLS, CATEGORICAL_COLS),
+        ),
+        memory_budget(MEMORY_BUDGET_MB),
+    )
+    logging.info("transforming %s rows at a time", CHUNKSIZE)
+
+    chunks = iter_chunks(args.input, KEEP_COLS, CHUNKSIZE)
+    totals = None if args.totals is None else []
+    if args.jobs == 1:
+        transform_serial(
+            chunks, KEEP_COLS, args.yaml_files, args.output, args.compact, totals
+        )
+    else:
+        transform_parallel(
+            chunks,
+            KEEP_COLS,
+            args.yaml_files,
+            args.output,
+            args.compact,
+            totals,
+            args.jobs or os.cpu_count(),
+        )
+
+    if totals is not None:
+        totals = combine_totals(totals)
+        write_table(totals, args.totals)
+        logging.info("wrote %s totals to %s", len(totals), args.totals)
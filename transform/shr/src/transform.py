@@ -1,17 +1,36 @@
 """transforms the output of fixed width file extraction"""
 
+import argparse
+import itertools
 import logging
-import sys
+import re
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from standardize import standardize_ori
 from assign_unique_ids import assign_unique_ids
+from chunking import SAMPLE_ROWS, bytes_per_row, memory_budget, pick_chunksize
+from columnar import is_parquet, iter_tables, read_table, write_table
+from fwf import read_schema
 
 logging.basicConfig(filename="output/transform.log", filemode="w", level=logging.INFO)
 
 # columns that begin with the word "offender" or "victim" but do not contain offender information
 EXCLUDE_COLS = ["victim_count", "offender_count"]
 
+# schema of the fixed-width files, which lists the columns of each offender and victim
+SCHEMA_FILENAME = "input/fwf-schema.csv"
+
+# matches the columns of an offender or victim slot, e.g. 'victim2_age'. Columns of
+# the first slot have no number, e.g. 'victim_age'
+SLOT_PAT = r"^(?P<fieldname>offender|victim)(?P<slot>\d*)_(?P<subfield>.+)$"
+
+# columns of each offender and victim record that identify their incident
+ID_COLS = ["incident_unique_id", "year", "ori_code"]
+
+# megabytes of memory each chunk may use with --chunked, unless MEMORY_BUDGET_MB is set
+MEMORY_BUDGET_MB = 64
+
 # see documents/ucr-2019-NIBRS-technical-specification-070120.pdf page 103
 AGE_VALUES = {
     "NN": 0,
@@ -29,6 +48,21 @@ DTYPES = {
     },
 }
 
+# schemas of outputs that are written as parquet datasets. Offender and victim
+# columns depend on the input, so their schemas are built by slot_schema
+ARROW_SCHEMAS = {
+    "incidents": pa.schema(
+        [
+            ("incident_unique_id", pa.string()),
+            ("ori_code", pa.string()),
+            ("last_update", pa.timestamp("ns")),
+            ("year", pa.int64()),
+            ("homicide", pa.string()),
+            ("situation", pa.string()),
+        ]
+    ),
+}
+
 
 def drop_empty_rows(df, exclude_cols="id"):
     """drops completely empty rows
@@ -53,124 +87,210 @@ def drop_empty_rows(df, exclude_cols="id"):
     return df
 
 
-def clean_year(yearno):
+def clean_year(years):
     """converts years in original format to full 4-digit years
 
     Args:
-        yearno (any): existing year value
+        years (pandas.Series): existing year values
 
     Returns:
-        int | np.NaN: integer or NaN if provided value was NaN
+        pandas.Series: 4-digit years, NaN where the provided value was NaN
     """
-    if pd.isna(yearno):
-        return yearno
-
     # data starts at 1965
-    if yearno >= 65:
-        return yearno + 1900
+    return years + np.where(years >= 65, 1900, 2000)
+
+
+def clean_age(ages):
+    """
+    cleans offender or victim age values. Numbers are truncated to integers, and
+    codes are looked up in AGE_VALUES
+
+    Args:
+        ages (pandas.Series): existing age values, as numbers or strings
+
+    Raises:
+        ValueError: if an age isn't a non-negative number or a code in AGE_VALUES
+
+    Returns:
+        pandas.Series: float ages, NaN if unknown or missing
+    """
+    numbers = pd.to_numeric(ages, errors="coerce")
+    is_code = ages.isin(list(AGE_VALUES))
 
-    return yearno + 2000
+    invalid = (ages.notna() & numbers.isna() & ~is_code) | (numbers < 0)
+    if invalid.any():
+        raise ValueError(
+            f"invalid literal for int() with base 10: {ages[invalid].iloc[0]!r}"
+        )
+
+    # a number is formatted as 2 digits, so 0 is the same as the '00' code
+    cleaned = np.trunc(numbers).mask(numbers.abs() < 1, AGE_VALUES["00"])
+    return cleaned.mask(is_code, ages.map(AGE_VALUES)).astype(float)
 
 
-def clean_age(age):
-    """cleans offender age values
+def clean_update_date(update_dates):
+    """converts original variable-length mdy format to pandas Timestamps
 
     Args:
-        age (any): existing age value
+        update_dates (pandas.Series): original date values
+
+    Raises:
+        AssertionError: if a date doesn't have 5 or 6 digits
 
     Returns:
-        int | np.NaN: integer or NaN if invalid age
+        pandas.Series: parsed date values, NaT where the provided value was NaN
     """
+    present = update_dates.notna()
+    digits = update_dates[present].astype(np.int64).astype(str)
+    wrong_length = ~digits.str.len().isin([5, 6])
+    assert not wrong_length.any(), digits[wrong_length].iloc[0]
 
-    try:
-        age = str(int(age)).zfill(2)
-    except ValueError as exc:
-        ermsg = str(exc)
-        if ermsg == "cannot convert float NaN to integer":
-            return np.NaN
-        # if a string, hold on to the value and try converting it from known string values
-        if not ermsg.startswith("invalid literal for int() with base 10:"):
-            raise exc
+    parsed = pd.Series(pd.NaT, index=update_dates.index, dtype="datetime64[ns]")
+    parsed[present] = pd.to_datetime(digits.str.zfill(6), format="%m%d%y")
+    return parsed
+
+
+def build_slot_plan(schema, fieldname):
+    """
+    groups the offender or victim columns of the schema by slot. Every SHR record has
+    the same slots, so this is done once for the whole file
+
+    Args:
+        schema (list): output of fwf.read_schema
+        fieldname (str): offender or victim
 
-    if age in AGE_VALUES:
-        return AGE_VALUES[age]
+    Returns:
+        dict: sequence number of each slot, mapped to a dict of the names of its
+            columns in the output and in the input, e.g. {3: {"victim_age":
+            "victim2_age", ...}, ...}
+    """
+    plan = {}
+    for column, _, _ in schema:
+        match = re.search(SLOT_PAT, column)
+        if match is None or column in EXCLUDE_COLS:
+            continue
+        if match.group("fieldname") != fieldname:
+            continue
 
-    if age.isnumeric():
-        return float(age)
+        # the first slot is 1 and later slots are 1 more than their number, e.g.
+        # 'victim2_age' is sequence 3
+        sequence = int(match.group("slot") or 0) + 1
+        plan.setdefault(sequence, {})[f"{fieldname}_{match.group('subfield')}"] = column
 
-    raise ValueError(ermsg)
+    return plan
 
 
-def clean_update_date(update_date):
-    """converts original variable-length mdy format to pandas Timestamp
+def prune_slot_plan(plan, has_values):
+    """
+    drops the columns that have no values from a slot plan, so their subfields
+    aren't output
 
     Args:
-        update_date (float): original date value
+        plan (dict): output of build_slot_plan
+        has_values (dict | pandas.Series): whether each column in the data has any
+            values
+
+    Raises:
+        ValueError: if a column in plan isn't in the data
 
     Returns:
-        pd.Timestamp: parsed date value
+        dict: plan without the columns that have no values, or slots without any
+            columns
     """
-    if pd.isna(update_date):
-        return update_date
+    missing = [col for slot in plan.values() for col in slot.values()]
+    missing = [col for col in missing if col not in has_values]
+    if len(missing) > 0:
+        raise ValueError(f"columns {missing} in {SCHEMA_FILENAME} not found in data")
+
+    pruned = {
+        sequence: {name: col for name, col in slot.items() if has_values[col]}
+        for sequence, slot in plan.items()
+    }
+    return {sequence: slot for sequence, slot in pruned.items() if len(slot) > 0}
 
-    update_date = str(int(update_date))
-    assert len(update_date) in [5, 6], update_date
-    update_date = str(int(update_date)).zfill(6)
 
-    update_date = pd.to_datetime(update_date, format="%m%d%y")
-    return update_date
+def slot_subfields(plan):
+    """lists the names of the output columns of every slot in a slot plan, sorted"""
+    return sorted({name for columns in plan.values() for name in columns})
 
 
-def split_records(df, fieldname):
-    """splits rows describing multiple people to one row per individual"""
-    field_df = (
-        df.melt(
-            id_vars=["incident_unique_id", "ori_code", "year"],
-            value_vars=[
-                col
-                for col in df.columns
-                if col.startswith(fieldname) and col not in EXCLUDE_COLS
-            ],
-        )
-        .query("value.notna()")
-        .reset_index()
-        .drop("index", axis=1)
-        .assign(
-            **{
-                f"{fieldname}_sequence": lambda df: df.variable.str.extract(
-                    rf"(?<={fieldname})(?P<seq>\d*)(?=_)"
-                )["seq"]
-                .replace({"": 0})
-                .astype(int)
-                .add(1)  # from 0-indexed to 1
-            }
-        )
-        .assign(
-            variable=lambda df: df.variable.str.replace(
-                # strip group numbers from variable names
-                # e.g. "victim2_age -> victim_age"
-                rf"(?<={fieldname})\d*(?=_)",
-                "",
-                regex=True,
+def slot_schema(fieldname, plan):
+    """builds the arrow schema of the offenders or victims split with plan
+
+    Args:
+        fieldname (str): offender or victim
+        plan (dict): output of build_slot_plan
+
+    Returns:
+        pyarrow.Schema: schema of the output of split_records
+    """
+    return pa.schema(
+        [
+            (f"{fieldname}_unique_id", pa.string()),
+            ("incident_unique_id", pa.string()),
+            ("year", pa.int64()),
+            ("ori_code", pa.string()),
+            (f"{fieldname}_sequence", pa.int64()),
+        ]
+        + [
+            (name, pa.float64() if name == f"{fieldname}_age" else pa.string())
+            for name in slot_subfields(plan)
+        ]
+    )
+
+
+def split_records(df, fieldname, plan):
+    """
+    splits rows describing multiple people to one row per individual. The columns of
+    each slot are stacked under each other, and slots without any values are dropped
+
+    Args:
+        df (pandas.DataFrame): incidents with the columns in plan
+        fieldname (str): offender or victim
+        plan (dict): output of build_slot_plan
+
+    Returns:
+        pandas.DataFrame: one row per offender or victim, sorted by incident and
+            sequence number
+    """
+    input_cols = [col for columns in plan.values() for col in columns.values()]
+
+    sequence_col = f"{fieldname}_sequence"
+    subfields = slot_subfields(plan)
+    # the columns' common dtype, like melt used: floats if every column has numbers,
+    # otherwise objects that keep the type of their column. Subfields a slot doesn't
+    # have are missing, so integers become floats, like they did when pivoting
+    values = df[input_cols].to_numpy()
+    dtype = np.result_type(values.dtype, np.float64)
+    positions = {col: i for i, col in enumerate(input_cols)}
+
+    slots = []
+    for sequence, columns in plan.items():
+        # subfields a slot doesn't have, e.g. offender_weapon_used after slot 1, are
+        # missing
+        block = np.full((len(df), len(subfields)), np.NaN, dtype=dtype)
+        for i, subfield in enumerate(subfields):
+            if subfield in columns:
+                block[:, i] = values[:, positions[columns[subfield]]]
+
+        present = pd.notna(block).any(axis=1)
+        slot_df = df.loc[present, ID_COLS].reset_index(drop=True)
+        slot_df[sequence_col] = sequence
+        slots.append(
+            pd.concat(
+                [slot_df, pd.DataFrame(block[present], columns=subfields)], axis=1
             )
         )
-        .pivot(
-            index=[
-                "incident_unique_id",
-                "year",
-                "ori_code",
-                f"{fieldname}_sequence",
-            ],
-            columns="variable",
-            values="value",
-        )
-        .reset_index()
+
+    field_df = (
+        pd.concat(slots, ignore_index=True)
+        .sort_values(["incident_unique_id", sequence_col], ignore_index=True)
         .pipe(
             assign_unique_ids,
             "incident_unique_id",
             "year",
             "ori_code",
-            f"{fieldname}_sequence",
+            sequence_col,
         )
         .rename(columns={"unique_id": f"{fieldname}_unique_id"})
     )
@@ -178,16 +298,28 @@ def split_records(df, fieldname):
     return field_df
 
 
-def do_transformation(df):
-    """does all necessary transformations"""
+def do_transformation(df, slot_plans, output_format="csv", part_number=0):
+    """does all necessary transformations
+
+    Args:
+        df (pandas.DataFrame): original dataframe from the output of extract/. Its
+            index is the position of each row in the file.
+        slot_plans (dict): offender and victim, mapped to the output of
+            build_slot_plan for each, pruned to the columns that have values
+        output_format (str, optional): csv, or parquet to write datasets partitioned
+            by year. Defaults to "csv".
+        part_number (int, optional): number of the chunk of the file in df. Parts
+            after the first are appended to the outputs. Defaults to 0.
+    """
     # first drop all empty rows
     df = drop_empty_rows(df)
     # then do initial cleaning and standardization
-    df["year"] = df.year.apply(clean_year)
-    df["last_update"] = df.last_update.apply(clean_update_date)
+    df["year"] = clean_year(df.year)
+    df["last_update"] = clean_update_date(df.last_update)
     df["ori_code"] = df.ori_code.apply(standardize_ori)
     # assign unique IDs
-    # using index becasue each row should be unique
+    # using index becasue each row should be unique, and it's the same for a row
+    # whether the whole file is transformed at once or in chunks
     df = (
         assign_unique_ids(df.reset_index(), "index")
         .rename(
@@ -209,8 +341,13 @@ def do_transformation(df):
                 "situation",
             ]
         ],
-        "offenders": split_records(df, "offender"),
-        "victims": split_records(df, "victim"),
+        "offenders": split_records(df, "offender", slot_plans["offender"]),
+        "victims": split_records(df, "victim", slot_plans["victim"]),
+    }
+    schemas = {
+        "incidents": ARROW_SCHEMAS["incidents"],
+        "offenders": slot_schema("offender", slot_plans["offender"]),
+        "victims": slot_schema("victim", slot_plans["victim"]),
     }
     for filename, out_df in out_dfs.items():
         try:
@@ -219,7 +356,7 @@ def do_transformation(df):
             for age_field in age_fields:
                 age_field = f"{age_field}_age"
                 if age_field in out_df.columns:
-                    out_df[age_field] = out_df[age_field].apply(clean_age)
+                    out_df[age_field] = clean_age(out_df[age_field])
 
             # change necessary dtypes
             if filename in DTYPES:
@@ -227,7 +364,13 @@ def do_transformation(df):
 
             out_df = drop_empty_rows(out_df, ["incident_unique_id", "id"])
 
-            out_df.to_csv(f"output/shr_{filename}.csv", index=False)
+            write_table(
+                out_df,
+                f"output/shr_{filename}.{output_format}",
+                schema=schemas[filename],
+                part_number=part_number,
+                append=part_number > 0,
+            )
 
         except Exception as exc:
             raise ValueError(
@@ -235,5 +378,231 @@ def do_transformation(df):
             ) from exc
 
 
+def to_numbers(df, dtypes=None):
+    """
+    converts the strings that extract/ stores in parquet datasets to numbers, the
+    way read_csv infers them
+
+    Args:
+        df (pandas.DataFrame): dataframe read from a parquet dataset
+        dtypes (dict, optional): dtype of each column, from infer_dtypes. Defaults to
+            None, which converts every column that only has numbers.
+
+    Returns:
+        pandas.DataFrame: dataframe with numbers converted
+    """
+    df = df.drop(columns="data_year")
+    if dtypes is None:
+        return df.apply(pd.to_numeric, errors="ignore")
+
+    numeric = {col: dtype for col, dtype in dtypes.items() if dtype != object}
+    df[list(numeric)] = df[list(numeric)].apply(pd.to_numeric).astype(numeric)
+    return df
+
+
+def combine_dtypes(dtypes):
+    """
+    gets the dtype read_csv infers for a whole column from the dtypes it inferred for
+    chunks of it: strings if any chunk has strings, otherwise the widest number type
+
+    Args:
+        dtypes (list): numpy dtypes of the column in each chunk
+
+    Returns:
+        numpy.dtype: dtype of the column
+    """
+    if any(dtype == object for dtype in dtypes):
+        return np.dtype(object)
+
+    if np.dtype(bool) in dtypes and len(set(dtypes)) > 1:
+        return np.dtype(object)
+
+    return np.result_type(*dtypes)
+
+
+class SampleMismatch(Exception):
+    """raised when a chunk doesn't fit the dtypes inferred from the first chunks"""
+
+
+def infer_dtypes(path, chunksize, max_chunks=None):
+    """
+    reads the input in chunks to find the dtype of each column, so every chunk can be
+    read with the same dtypes as reading the whole file at once
+
+    Args:
+        path (str): path to csv file or parquet dataset
+        chunksize (int): number of rows per chunk
+        max_chunks (int, optional): number of chunks to read. Defaults to None, which
+            reads the whole file.
+
+    Returns:
+        tuple: dicts of the dtype of each column, and of whether it has any values
+    """
+    chunk_dtypes = {}
+    has_values = {}
+    chunks = iter_tables(path, chunksize, low_memory=False)
+    for chunk in itertools.islice(chunks, max_chunks):
+        if is_parquet(path):
+            chunk = to_numbers(chunk)
+        for col in chunk.columns:
+            chunk_dtypes.setdefault(col, set()).add(chunk[col].dtype)
+            has_values[col] = has_values.get(col, False) or chunk[col].notna().any()
+
+    dtypes = {col: combine_dtypes(list(found)) for col, found in chunk_dtypes.items()}
+    return dtypes, has_values
+
+
+def read_chunks(path, chunksize, dtypes, has_values):
+    """
+    reads the input in chunks with dtypes. Each chunk is indexed by the position of
+    its rows in the whole file
+
+    Args:
+        path (str): path to csv file or parquet dataset
+        chunksize (int): number of rows per chunk
+        dtypes (dict): dtypes from infer_dtypes
+        has_values (dict): whether each column has any values, from infer_dtypes
+
+    Raises:
+        SampleMismatch: if a value can't be read as the dtype of its column, e.g. a
+            string in a column of integers, or a column without values has one. The
+            dtypes of the whole file are different, so chunks read so far were read
+            differently than reading the whole file would
+
+    Yields:
+        pandas.DataFrame: chunks of chunksize rows
+    """
+    if is_parquet(path):
+        chunks = (to_numbers(chunk, dtypes) for chunk in iter_tables(path, chunksize))
+    else:
+        chunks = iter_tables(path, chunksize, dtype=dtypes, low_memory=False)
+    empty_cols = [col for col, found in has_values.items() if not found]
+
+    offset = 0
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        except (TypeError, ValueError) as exc:
+            raise SampleMismatch(
+                f"rows after {offset} don't fit the inferred dtypes"
+            ) from exc
+
+        if chunk[empty_cols].notna().any(axis=None):
+            raise SampleMismatch(
+                f"rows after {offset} have values in columns inferred to be empty"
+            )
+
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+
+def transform_chunks(path, chunksize, slot_plans, output_format, dtypes, has_values):
+    """
+    transforms the chunks from read_chunks, replacing the outputs with the first one
+    and appending the others
+
+    Args:
+        path (str): path to csv file or parquet dataset
+        chunksize (int): number of rows per chunk
+        slot_plans (dict): offender and victim, mapped to the output of
+            build_slot_plan for each
+        output_format (str): csv or parquet
+        dtypes (dict): dtypes from infer_dtypes
+        has_values (dict): whether each column has any values, from infer_dtypes
+
+    Raises:
+        SampleMismatch: see read_chunks
+    """
+    slot_plans = {
+        fieldname: prune_slot_plan(plan, has_values)
+        for fieldname, plan in slot_plans.items()
+    }
+    for part_number, chunk in enumerate(
+        read_chunks(path, chunksize, dtypes, has_values)
+    ):
+        do_transformation(chunk, slot_plans, output_format, part_number)
+
+
+def transform_chunked(path, slot_plans, output_format):
+    """
+    transforms the input in chunks that fit in the memory budget, appending each
+    chunk's incidents, offenders and victims to the outputs. Rows have the same ids
+    and values as when transforming the whole file at once, but offenders and victims
+    are only sorted within each chunk.
+
+    dtypes are inferred from the first chunk, so the input is only read once more
+    than that chunk. If a later chunk needs other dtypes, e.g. it has a string in a
+    column of numbers, dtypes are inferred from the whole input and the transform
+    starts over, which reads the input up to three times
+
+    Args:
+        path (str): path to csv file or parquet dataset
+        slot_plans (dict): offender and victim, mapped to the output of
+            build_slot_plan for each
+        output_format (str): csv or parquet
+    """
+    sample = next(iter_tables(path, SAMPLE_ROWS, low_memory=False))
+    chunksize = pick_chunksize(bytes_per_row(sample), memory_budget(MEMORY_BUDGET_MB))
+    logging.info("transforming %s rows at a time", chunksize)
+
+    try:
+        transform_chunks(
+            path,
+            chunksize,
+            slot_plans,
+            output_format,
+            *infer_dtypes(path, chunksize, max_chunks=1),
+        )
+    except SampleMismatch as exc:
+        logging.info("%s, inferring dtypes from the whole input and starting over", exc)
+        transform_chunks(
+            path, chunksize, slot_plans, output_format, *infer_dtypes(path, chunksize)
+        )
+
+
+def parse_args():
+    """parses command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input", help="path to output of extract/shr")
+    parser.add_argument(
+        "output_format",
+        nargs="?",
+        choices=["csv", "parquet"],
+        default="csv",
+        help="format of the outputs",
+    )
+    parser.add_argument(
+        "--chunked",
+        action="store_true",
+        help="transform the input in chunks that fit in the memory budget",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    do_transformation(pd.read_csv(sys.argv[1], low_memory=False))
+    args = parse_args()
+
+    schema = read_schema(SCHEMA_FILENAME)
+    slot_plans = {
+        fieldname: build_slot_plan(schema, fieldname)
+        for fieldname in ["offender", "victim"]
+    }
+
+    if args.chunked:
+        transform_chunked(args.input, slot_plans, args.output_format)
+    else:
+        master_df = read_table(args.input, low_memory=False)
+        if is_parquet(args.input):
+            # extract/ stores every value as a string and adds the year it partitions
+            # on, so drop that and infer numbers like read_csv does
+            master_df = to_numbers(master_df)
+
+        has_values = master_df.notna().any()
+        slot_plans = {
+            fieldname: prune_slot_plan(plan, has_values)
+            for fieldname, plan in slot_plans.items()
+        }
+        do_transformation(master_df, slot_plans, args.output_format)